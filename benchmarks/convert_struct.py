@@ -0,0 +1,61 @@
+#Compares the compiled struct converters against the reflective converter
+#they replaced. Only needs cffi and spotify.processed.h, not libspotify.
+#Run from the repository root: python benchmarks/convert_struct.py
+import os
+import sys
+import timeit
+from cffi import FFI
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from converters import compile_converter
+
+ffi = FFI()
+with open('spotify.processed.h') as file:
+    ffi.cdef(file.read())
+
+#The reflective converter previously in utils.py,
+#from https://gist.github.com/inactivist/4ef7058c2132fa16759d
+def convert_struct_field(s, fields):
+    for field,fieldtype in fields:
+        if fieldtype.type.kind == 'primitive':
+            yield (field,getattr( s, field ))
+        else:
+            yield (field, convert_to_python( getattr( s, field ) ))
+
+def convert_to_python(s):
+    type=ffi.typeof(s)
+    if type.kind == 'struct':
+        return dict(convert_struct_field( s, type.fields ) )
+    elif type.kind == 'array':
+        if type.item.kind == 'primitive':
+            if type.item.cname == 'char':
+                return ffi.string(s)
+            else:
+                return [ s[i] for i in range(type.length) ]
+        else:
+            return [ convert_to_python(s[i]) for i in range(type.length) ]
+    elif type.kind == 'primitive':
+        return int(s)
+
+def fill(struct, ctype):
+    for field, fieldtype in ffi.typeof(ctype).fields:
+        if fieldtype.type.kind == 'array':
+            setattr(struct, field, field[:fieldtype.type.length - 1])
+        else:
+            setattr(struct, field, 1234)
+
+def run(ctype, number):
+    struct = ffi.new(ctype + ' *')
+    fill(struct, ctype)
+    compiled = compile_converter(ffi, ctype)
+
+    assert compiled(struct[0]) == convert_to_python(struct[0])
+
+    reflective_time = timeit.timeit(lambda: convert_to_python(struct[0]), number=number)
+    compiled_time = timeit.timeit(lambda: compiled(struct[0]), number=number)
+    print '{:<16} reflective {:8.2f}us  compiled {:8.2f}us  speedup {:.1f}x'.format(ctype,
+        reflective_time / number * 1e6, compiled_time / number * 1e6, reflective_time / compiled_time)
+
+if __name__ == "__main__":
+    for ctype in ('SpMetadata', 'SpZeroConfVars'):
+        run(ctype, 20000)
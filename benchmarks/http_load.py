@@ -0,0 +1,232 @@
+#Load test for the web server. Simulated clients, e.g. dashboards polling the
+#status and phones changing the volume, request a weighted mix of routes while
+#the server plays audio from the stand-in libspotify (see playback.py) into
+#the null output. Reports latency per route, requests per second, and what the
+#load did to the pump and the audio. --clients takes a list to step through,
+#to find where audio starts to suffer. Options it doesn't know are passed on to
+#main.py. Run from anywhere:
+#python benchmarks/http_load.py --clients 1,10,50,100 --duration 20
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import httplib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib
+import urlparse
+from collections import defaultdict
+
+import gevent
+from playback import build, percentile, ROOT, STANDIN
+
+#(method, path, form, weight)
+ROUTES = [
+    ('GET', '/api/info/status', None, 30),
+    ('GET', '/api/info/metadata', None, 20),
+    ('GET', '/api/info/queue', None, 10),
+    ('GET', '/api/playback/volume', None, 10),
+    ('POST', '/api/playback/volume', {'value': 45000}, 5),
+    ('GET', '/api/playback/play', None, 5),
+    ('GET', '/api/audio/outputs', None, 5),
+    ('GET', '/api/metrics?format=json', None, 5),
+    ('GET', '/login/_zeroconf?action=getInfo', None, 10),
+]
+
+PERCENTILES = [50, 99]
+REQUEST_TIMEOUT = 10
+STARTUP_TIMEOUT = 30
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+class Client:
+    # One simulated client on its own keep-alive connection. Like a browser
+    # it sends back the ETag it got for each path, so cached snapshots are
+    # answered with 304s.
+    def __init__(self, url, think, results):
+        self.address = urlparse.urlparse(url).netloc
+        self.think = think
+        self.results = results
+        self.etags = {}
+        self.connection = None
+        self.choices = []
+        for method, path, form, weight in ROUTES:
+            self.choices.extend([(method, path, form)] * weight)
+
+    def request(self, method, path, form):
+        headers = {}
+        body = None
+        if path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        if form is not None:
+            body = urllib.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(self.address, timeout=REQUEST_TIMEOUT)
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+        if response.getheader('etag'):
+            self.etags[path] = response.getheader('etag')
+        return response.status
+
+    def run(self, deadline):
+        while time.time() < deadline:
+            method, path, form = random.choice(self.choices)
+            route = '{} {}'.format(method, path)
+            start = time.time()
+            try:
+                status = self.request(method, path, form)
+            except (httplib.HTTPException, socket.error):
+                self.connection.close()
+                self.connection = None
+                self.results.errors[route] += 1
+                continue
+
+            if status >= 400:
+                self.results.errors[route] += 1
+            else:
+                self.results.latencies[route].append(time.time() - start)
+
+            #Exponential think times, so clients don't fall into lockstep
+            if self.think:
+                gevent.sleep(min(random.expovariate(1.0 / self.think), max(deadline - time.time(), 0)))
+
+def get_json(url, path):
+    return json.load(urllib.urlopen(url + path))
+
+#Upper bound of the bucket the pth percentile of what was observed between
+#two snapshots of a histogram falls in
+def histogram_percentile(before, after, p):
+    counts = sorted((float(bound), count - before['buckets'][bound])
+                    for bound, count in after['buckets'].iteritems())
+    total = sum(count for bound, count in counts)
+    if not total:
+        return 0.0
+    seen = 0
+    for bound, count in counts:
+        seen += count
+        if seen >= total * p / 100.0:
+            return bound
+
+def start_server(url, server_args):
+    scratch = tempfile.mkdtemp(prefix='spotify-load-')
+    key = os.path.join(scratch, 'spotify_appkey.key')
+    with open(key, 'w') as f:
+        f.write('\0' * 321)
+
+    env = dict(os.environ)
+    env['LD_LIBRARY_PATH'] = ':'.join([STANDIN] + filter(None, [env.get('LD_LIBRARY_PATH')]))
+    env['LIBRARY_PATH'] = ':'.join([STANDIN] + filter(None, [env.get('LIBRARY_PATH')]))
+    log = open(os.path.join(scratch, 'main.log'), 'w')
+    print 'Starting main.py, log in {}'.format(log.name)
+    server = subprocess.Popen([sys.executable, 'main.py', '--output', 'null',
+                               '--key', key, '--username', 'loadtest', '--password', 'loadtest',
+                               '--credentials', os.path.join(scratch, 'credentials.json'),
+                               '--image-cache', os.path.join(scratch, 'image_cache')] + server_args,
+                              cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    #Up once it answers, ready once the stand-in is playing
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('main.py exited, see {}'.format(log.name))
+        try:
+            if get_json(url, '/api/info/status')['playing']:
+                return server
+        except (IOError, ValueError):
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('main.py did not start playing, see {}'.format(log.name))
+
+def run(url, clients, duration, think):
+    results = Results()
+    before = get_json(url, '/api/metrics?format=json')
+    start = time.time()
+    deadline = start + duration
+    gevent.joinall([gevent.spawn(Client(url, think, results).run, deadline) for i in xrange(clients)])
+    elapsed = time.time() - start
+    after = get_json(url, '/api/metrics?format=json')
+
+    pumps = after['spotify_pump_events_seconds']['count'] - before['spotify_pump_events_seconds']['count']
+    late_before = before['spotify_pump_late_seconds']
+    late_after = after['spotify_pump_late_seconds']
+    routes = {}
+    for route in sorted(set(results.latencies) | set(results.errors)):
+        latencies = sorted(results.latencies[route])
+        routes[route] = dict([('p{:g}'.format(p), percentile(latencies, p) * 1000) for p in PERCENTILES],
+                             requests=len(latencies), errors=results.errors[route],
+                             rate=len(latencies) / elapsed)
+    latencies = sorted(sum(results.latencies.values(), []))
+
+    return {
+        'clients': clients,
+        'seconds': elapsed,
+        'routes': routes,
+        'total': dict([('p{:g}'.format(p), percentile(latencies, p) * 1000) for p in PERCENTILES],
+                      requests=len(latencies), errors=sum(results.errors.values()),
+                      rate=len(latencies) / elapsed),
+        'pumps_per_second': pumps / elapsed,
+        'pump_late_ms': dict(('p{:g}'.format(p), histogram_percentile(late_before, late_after, p) * 1000)
+                             for p in PERCENTILES),
+        'underruns': after['audio_underruns_total'] - before['audio_underruns_total'],
+        'buffer_full': after['spotify_buffer_full_total'] - before['spotify_buffer_full_total'],
+    }
+
+def report(result):
+    print
+    print '{} clients, {:.1f} s'.format(result['clients'], result['seconds'])
+    print '{:<45} {:>8} {:>7} {:>8} {:>9} {:>9}'.format('route', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p99 (ms)')
+    for route, stats in sorted(result['routes'].iteritems()) + [('total', result['total'])]:
+        print '{:<45} {:>8} {:>7} {:>8.1f} {:>9.2f} {:>9.2f}'.format(
+                route, stats['requests'], stats['errors'], stats['rate'], stats['p50'], stats['p99'])
+    print 'pump: {:.1f} per second, late by <= {:g} ms (p50), <= {:g} ms (p99)'.format(
+            result['pumps_per_second'], result['pump_late_ms']['p50'], result['pump_late_ms']['p99'])
+    print 'audio: {} underruns, {} buffer full'.format(result['underruns'], result['buffer_full'])
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Load test for the web server, against a stand-in libspotify')
+    arg_parser.add_argument('--clients', help='concurrent clients, a comma separated list runs each in turn', default='1,10,50')
+    arg_parser.add_argument('--duration', help='seconds to run each number of clients for', type=float, default=10)
+    arg_parser.add_argument('--think', help='mean pause between requests of each client (s), 0 for none', type=float, default=1.0)
+    arg_parser.add_argument('--url', help='test a server that is already running instead of starting main.py', default=None)
+    arg_parser.add_argument('--json', help='print the results as JSON, e.g. to compare runs', action='store_true')
+    args, server_args = arg_parser.parse_known_args()
+
+    try:
+        steps = [int(clients) for clients in args.clients.split(',')]
+    except ValueError:
+        arg_parser.error('--clients must be a comma separated list of numbers')
+
+    url = (args.url or 'http://127.0.0.1:4000').rstrip('/')
+    server = None
+    if args.url is None:
+        build()
+        server = start_server(url, server_args)
+
+    try:
+        results = []
+        for clients in steps:
+            results.append(run(url, clients, args.duration, args.think))
+            if not args.json:
+                report(results[-1])
+        if args.json:
+            print json.dumps(results, indent=2, sort_keys=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
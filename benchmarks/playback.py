@@ -0,0 +1,205 @@
+#Plays synthetic audio from the stand-in libspotify (benchmarks/standin)
+#through connect.py, console_callbacks.playback_data and Player into the null
+#sink, and reports what it cost. No libspotify, account or sound card needed.
+#Options it doesn't know are passed on to connect.py, e.g. --latency low,
+#--gain -3 or --nonblock. Run from anywhere:
+#python benchmarks/playback.py --seconds 20 --speed 4
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STANDIN = os.path.join(ROOT, 'benchmarks', 'standin')
+SOURCE = os.path.join(STANDIN, 'spotify.c')
+LIBRARY = os.path.join(STANDIN, 'libspotify_embedded_shared.so')
+
+STATS = """
+typedef struct {
+    uint64_t calls;
+    uint64_t offered;
+    uint64_t accepted;
+    uint64_t short_writes;
+    uint64_t pumps;
+    uint64_t tracks;
+    double callback_seconds;
+} StandinStats;
+
+void standin_stats(StandinStats *out);
+size_t standin_latencies(double *out, size_t size);
+void standin_reset(void);
+"""
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+def build():
+    if os.path.exists(LIBRARY) and os.path.getmtime(LIBRARY) >= os.path.getmtime(SOURCE):
+        return
+    print 'Building {}'.format(os.path.relpath(LIBRARY, ROOT))
+    subprocess.check_call(['cc', '-shared', '-fPIC', '-O2', '-I', ROOT,
+                           '-o', LIBRARY, SOURCE, '-lm'])
+
+#The dynamic linker only reads LD_LIBRARY_PATH at startup, so the benchmark
+#starts over in a new interpreter that finds the stand-in instead of
+#libspotify. LIBRARY_PATH covers linking when ffi.verify has to build.
+def exec_with_standin():
+    if os.environ.get('LD_LIBRARY_PATH', '').split(':')[0] == STANDIN:
+        return
+    env = dict(os.environ)
+    for name in ['LD_LIBRARY_PATH', 'LIBRARY_PATH']:
+        env[name] = ':'.join([STANDIN] + filter(None, [env.get(name)]))
+    os.execve(sys.executable, [sys.executable, os.path.abspath(__file__)] + sys.argv[1:], env)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+#User plus system CPU seconds used by the process so far
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+#Resident set size now (MB), 0 where /proc isn't available
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except IOError:
+        return 0.0
+
+def run(args, connect_args):
+    os.environ['SPOTIFY_STANDIN_SPEED'] = str(args.speed)
+    os.environ['SPOTIFY_STANDIN_CHUNK'] = str(args.chunk)
+    os.environ['SPOTIFY_STANDIN_BURST'] = str(args.burst)
+    os.environ['SPOTIFY_STANDIN_AHEAD_MS'] = str(args.ahead)
+
+    scratch = tempfile.mkdtemp(prefix='spotify-benchmark-')
+    key = os.path.join(scratch, 'spotify_appkey.key')
+    with open(key, 'w') as f:
+        f.write('\0' * 321)
+
+    #console_callbacks and connect read their options from sys.argv on import
+    sys.argv = ['connect.py', '--output', 'null', '--device', str(args.speed),
+                '--key', key, '--username', 'benchmark', '--password', 'benchmark',
+                '--credentials', os.path.join(scratch, 'credentials.json'),
+                '--image-cache', os.path.join(scratch, 'image_cache')] + connect_args
+
+    #Keep the callbacks' prints out of the report
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+    import cffi
+    import metrics
+    import realtime
+    from connect import Connect
+    from console_callbacks import audio_player, CHANNELS, RATE
+    from pump import Pump
+
+    ffi = cffi.FFI()
+    ffi.cdef(STATS)
+    standin = ffi.dlopen(LIBRARY)
+    stats = ffi.new('StandinStats *')
+
+    connect = Connect()
+    pump = Pump(connect)
+
+    #Up to the first audio, so startup isn't part of the measurement
+    while not audio_player.playing():
+        pump.run_once()
+        time.sleep(0.001)
+    standin.standin_reset()
+    underruns = metrics.underruns.value
+
+    target = args.seconds * RATE
+    played = 0
+    start_cpu = cpu_time()
+    start = time.time()
+    while played < target:
+        wait = pump.run_once()
+        time.sleep(0 if args.speed == 0 else wait)
+        standin.standin_stats(stats)
+        #Audio accepted that isn't still waiting to be played
+        played = stats.accepted / CHANNELS - audio_player.buffer_length() - audio_player.device_delay()
+    wall = time.time() - start
+    cpu = cpu_time() - start_cpu
+
+    sys.stdout = stdout
+    latencies = ffi.new('double[]', stats.calls)
+    latencies = sorted(latencies[0:standin.standin_latencies(latencies, stats.calls)])
+    audio = played / float(RATE)
+
+    return {
+        'audio_seconds': audio,
+        'wall_seconds': wall,
+        'speed': audio / wall,
+        'cpu_seconds': cpu,
+        'cpu_per_audio_second': cpu / audio,
+        'callbacks': stats.calls,
+        'callback_ms': dict([('p{:g}'.format(p), percentile(latencies, p) * 1000) for p in PERCENTILES] +
+                            [('max', latencies[-1] * 1000 if latencies else 0.0),
+                             ('mean', stats.callback_seconds * 1000 / max(stats.calls, 1))]),
+        'samples_offered': stats.offered,
+        'samples_accepted': stats.accepted,
+        'short_writes': stats.short_writes,
+        'underruns': metrics.underruns.value - underruns,
+        'outputs': audio_player.outputs(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'rss_mb': rss(),
+        'realtime': realtime.status(),
+    }
+
+def report(result):
+    print 'audio played      {:10.1f} s in {:.1f} s ({:.1f}x real time)'.format(
+            result['audio_seconds'], result['wall_seconds'], result['speed'])
+    print 'cpu               {:10.2f} s, {:.1f} ms per second of audio ({:.2f}%)'.format(
+            result['cpu_seconds'], result['cpu_per_audio_second'] * 1000, result['cpu_per_audio_second'] * 100)
+    print 'playback_data     {:10d} calls'.format(result['callbacks'])
+    for name in ['p{:g}'.format(p) for p in PERCENTILES] + ['max', 'mean']:
+        print '  {:<15} {:10.3f} ms'.format(name, result['callback_ms'][name])
+    offered = max(result['samples_offered'], 1)
+    print 'samples accepted  {:10d} of {} offered ({:.1f}%), {} short writes'.format(
+            result['samples_accepted'], result['samples_offered'],
+            result['samples_accepted'] * 100.0 / offered, result['short_writes'])
+    print 'underruns         {:10d}'.format(result['underruns'])
+    for output in result['outputs']:
+        print 'output {:<10} {:10d} dropped, {} xruns'.format(output['device'], output['dropped'], output['xruns'])
+    print 'memory            {:10.1f} MB max rss, {:.1f} MB now'.format(result['max_rss_mb'], result['rss_mb'])
+    applied = result['realtime']
+    print 'scheduling        {:>10} {}, audio cpus {}, web cpus {}, mlock {}'.format(
+            applied['policy'], applied['priority'], applied['audio_cpus'], applied['web_cpus'], applied['mlock'])
+    for name, error in sorted(applied['errors'].iteritems()):
+        print '  {:<15} {}'.format(name, error)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='End to end playback benchmark against a stand-in libspotify')
+    arg_parser.add_argument('--seconds', help='seconds of audio to play', type=float, default=20)
+    arg_parser.add_argument('--speed', help='how fast audio is delivered and played, as a multiple of real time. 0 for as fast as possible', type=float, default=1.0)
+    arg_parser.add_argument('--chunk', help='frames offered per playback_data call', type=int, default=2048)
+    arg_parser.add_argument('--burst', help='chunks held back and then delivered together', type=int, default=1)
+    arg_parser.add_argument('--ahead', help='how far delivery may run ahead of playback (ms)', type=int, default=500)
+    arg_parser.add_argument('--json', help='print the results as JSON, e.g. to compare runs', action='store_true')
+    arg_parser.add_argument('--verbose', help='show what connect.py prints', action='store_true')
+    args, connect_args = arg_parser.parse_known_args()
+
+    build()
+    exec_with_standin()
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    result = run(args, connect_args)
+    if args.json:
+        print json.dumps(result, indent=2, sort_keys=True)
+    else:
+        report(result)
+    #The playback thread may still be blocked in the sink
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
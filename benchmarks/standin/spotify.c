@@ -0,0 +1,643 @@
+/*
+ * Stand-in for libspotify_embedded_shared, implementing the spotify.h API
+ * well enough to run connect.py, main.py and the benchmarks without the real
+ * library, an account or a network connection.
+ *
+ * Logging in succeeds on the next SpPumpEvents. Unless
+ * SPOTIFY_STANDIN_AUTOPLAY=0 the device then becomes active and starts
+ * playing, and every SpPumpEvents after that hands a 441Hz tone to
+ * audio_data. Samples that aren't accepted are offered again on the next
+ * pump, like libspotify does. Tracks are synthetic and follow each other
+ * forever.
+ *
+ * Delivery is set through the environment, read by SpInit:
+ *   SPOTIFY_STANDIN_SPEED     audio delivered per second of wall clock, as a
+ *                             multiple of real time. 0 delivers as much as
+ *                             audio_data accepts (default 1)
+ *   SPOTIFY_STANDIN_CHUNK     frames offered per audio_data call (default 2048)
+ *   SPOTIFY_STANDIN_BURST     chunks held back and then delivered together
+ *                             (default 1)
+ *   SPOTIFY_STANDIN_AHEAD_MS  how far delivery may run ahead of the clock,
+ *                             like a client decoding ahead (default 500)
+ *   SPOTIFY_STANDIN_TRACK_MS  length of each track (default 180000)
+ *   SPOTIFY_STANDIN_AUTOPLAY  start playing after logging in (default 1)
+ *
+ * Every audio_data call is timed, standin_stats and standin_latencies read
+ * the results (see benchmarks/playback.py).
+ *
+ * Build from the repository root:
+ *   cc -shared -fPIC -O2 -I. -o benchmarks/standin/libspotify_embedded_shared.so \
+ *       benchmarks/standin/spotify.c -lm
+ */
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "spotify.h"
+
+#define RATE 44100
+#define CHANNELS 2
+#define TONE_HZ 441
+#define MAX_EVENTS 64
+#define MAX_LATENCIES (1 << 22)
+/* Most audio delivered by one SpPumpEvents when unthrottled (frames) */
+#define MAX_UNTHROTTLED RATE
+/* Falling further behind than this (frames) restarts the delivery clock,
+ * rather than flooding the player once it accepts audio again */
+#define MAX_BEHIND (2 * RATE)
+
+typedef struct {
+    uint64_t calls;
+    uint64_t offered;
+    uint64_t accepted;
+    uint64_t short_writes;
+    uint64_t pumps;
+    uint64_t tracks;
+    double callback_seconds;
+} StandinStats;
+
+enum {
+    EV_CONNECTION,
+    EV_PLAYBACK,
+    EV_SEEK,
+    EV_VOLUME,
+    EV_LOGIN,
+};
+
+struct event {
+    int type;
+    uint32_t value;
+};
+
+static int initialized;
+static SpConfig config;
+static char remote_name[0x40];
+static char username[0x40];
+
+static SpConnectionCallbacks connection_callbacks;
+static void *connection_userdata;
+static SpPlaybackCallbacks playback_callbacks;
+static void *playback_userdata;
+static SpDebugCallbacks debug_callbacks;
+static void *debug_userdata;
+
+static struct event events[MAX_EVENTS];
+static int events_head, events_count;
+
+static bool logged_in, active, playing, shuffled, repeated;
+static uint16_t volume = 0xffff;
+static SpBitrate bitrate;
+static uint32_t track;
+static uint64_t track_frames;
+
+static double speed;
+static uint32_t chunk, burst, ahead, track_ms;
+static int autoplay;
+
+/* One second of the tone, plus a chunk so any offset has a whole chunk */
+static int16_t *tone;
+static uint32_t chunk_offset;
+static double clock_start;
+static uint64_t clock_frames;
+
+static StandinStats stats;
+static double *latencies;
+static size_t latencies_count, latencies_size;
+
+static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static double env_double(const char *name, double fallback)
+{
+    const char *value = getenv(name);
+    return value && *value ? atof(value) : fallback;
+}
+
+static void push(int type, uint32_t value)
+{
+    if (events_count == MAX_EVENTS)
+        return;
+    events[(events_head + events_count) % MAX_EVENTS].type = type;
+    events[(events_head + events_count) % MAX_EVENTS].value = value;
+    events_count++;
+}
+
+static void debug(const char *msg)
+{
+    if (debug_callbacks.message)
+        debug_callbacks.message(msg, debug_userdata);
+}
+
+static void connection_notify(SpConnectionNotify type)
+{
+    if (connection_callbacks.notify)
+        connection_callbacks.notify(type, connection_userdata);
+}
+
+static void playback_notify(SpPlaybackNotify type)
+{
+    if (playback_callbacks.notify)
+        playback_callbacks.notify(type, playback_userdata);
+}
+
+static void record_latency(double seconds)
+{
+    if (latencies_count == latencies_size) {
+        size_t size = latencies_size ? latencies_size * 2 : 4096;
+        double *grown;
+        if (size > MAX_LATENCIES)
+            return;
+        grown = realloc(latencies, size * sizeof(double));
+        if (!grown)
+            return;
+        latencies = grown;
+        latencies_size = size;
+    }
+    latencies[latencies_count++] = seconds;
+}
+
+static void restart_clock(void)
+{
+    clock_start = now();
+    clock_frames = 0;
+}
+
+static void start_track(uint32_t index)
+{
+    track = index;
+    track_frames = 0;
+    chunk_offset = 0;
+    stats.tracks++;
+}
+
+static void dispatch(struct event *event)
+{
+    switch (event->type) {
+    case EV_LOGIN:
+        logged_in = true;
+        debug("standin: logged in");
+        connection_notify(kSpConnectionNotifyLoggedIn);
+        if (connection_callbacks.new_credentials)
+            connection_callbacks.new_credentials("standin-credentials", connection_userdata);
+        if (autoplay && !active) {
+            active = true;
+            playing = true;
+            restart_clock();
+            playback_notify(kSpPlaybackNotifyBecameActive);
+            playback_notify(kSpPlaybackNotifyTrackChanged);
+            playback_notify(kSpPlaybackNotifyPlay);
+        }
+        break;
+    case EV_CONNECTION:
+        connection_notify(event->value);
+        break;
+    case EV_PLAYBACK:
+        playback_notify(event->value);
+        break;
+    case EV_SEEK:
+        if (playback_callbacks.seek)
+            playback_callbacks.seek(event->value, playback_userdata);
+        break;
+    case EV_VOLUME:
+        if (playback_callbacks.apply_volume)
+            playback_callbacks.apply_volume(event->value, playback_userdata);
+        break;
+    }
+}
+
+static void deliver_audio(void)
+{
+    SpSampleFormat format = { CHANNELS, kSpSampleTypeS16NativeEndian, RATE };
+    uint64_t track_length = (uint64_t)track_ms * RATE / 1000;
+    uint64_t due;
+
+    if (!playing || !playback_callbacks.audio_data)
+        return;
+
+    if (speed > 0) {
+        double target = (now() - clock_start) * RATE * speed + ahead;
+        if (target - clock_frames > ahead + MAX_BEHIND) {
+            restart_clock();
+            target = ahead;
+        }
+        if (target - clock_frames < chunk * burst)
+            return;
+        due = target - clock_frames;
+    } else {
+        due = MAX_UNTHROTTLED;
+    }
+
+    while (due > 0) {
+        uint32_t frames = chunk - chunk_offset;
+        uint32_t pending = 0;
+        uint32_t accepted;
+        double start;
+
+        if (frames > due)
+            frames = due;
+        if (frames > track_length - track_frames)
+            frames = track_length - track_frames;
+
+        start = now();
+        accepted = playback_callbacks.audio_data(
+                tone + (track_frames % RATE) * CHANNELS, frames * CHANNELS,
+                &format, &pending, playback_userdata);
+        start = now() - start;
+
+        if (accepted > frames * CHANNELS)
+            accepted = frames * CHANNELS;
+        stats.calls++;
+        stats.offered += frames * CHANNELS;
+        stats.accepted += accepted;
+        stats.callback_seconds += start;
+        record_latency(start);
+
+        accepted /= CHANNELS;
+        clock_frames += accepted;
+        track_frames += accepted;
+        chunk_offset = (chunk_offset + accepted) % chunk;
+        due -= accepted;
+
+        if (track_frames >= track_length) {
+            start_track(track + 1);
+            playback_notify(kSpPlaybackNotifyTrackChanged);
+        }
+        if (accepted < frames) {
+            stats.short_writes++;
+            break;
+        }
+    }
+}
+
+SpError SpInit(const SpConfig *init)
+{
+    uint32_t i;
+
+    if (!init)
+        return kSpErrorNullArgument;
+    if (initialized)
+        return kSpErrorAlreadyInitialized;
+    if (init->version != 4)
+        return kSpErrorWrongAPIVersion;
+
+    config = *init;
+    snprintf(remote_name, sizeof(remote_name), "%s", init->remoteName ? init->remoteName : "");
+
+    speed = env_double("SPOTIFY_STANDIN_SPEED", 1.0);
+    chunk = env_double("SPOTIFY_STANDIN_CHUNK", 2048);
+    burst = env_double("SPOTIFY_STANDIN_BURST", 1);
+    ahead = env_double("SPOTIFY_STANDIN_AHEAD_MS", 500) * RATE / 1000;
+    track_ms = env_double("SPOTIFY_STANDIN_TRACK_MS", 180000);
+    autoplay = env_double("SPOTIFY_STANDIN_AUTOPLAY", 1);
+    if (chunk < 1 || chunk > RATE)
+        chunk = 2048;
+    if (burst < 1)
+        burst = 1;
+    if (track_ms < 1000)
+        track_ms = 1000;
+
+    tone = malloc((RATE + chunk) * CHANNELS * sizeof(int16_t));
+    if (!tone)
+        return kSpErrorInitFailed;
+    for (i = 0; i < RATE + chunk; i++) {
+        int16_t sample = 16384 * sin(2 * M_PI * TONE_HZ * i / RATE);
+        tone[i * CHANNELS] = sample;
+        tone[i * CHANNELS + 1] = sample;
+    }
+
+    events_head = events_count = 0;
+    logged_in = active = playing = false;
+    start_track(0);
+    initialized = 1;
+    return kSpErrorOk;
+}
+
+void SpFree(void)
+{
+    free(tone);
+    tone = NULL;
+    initialized = 0;
+}
+
+SpError SpPumpEvents(void)
+{
+    if (!initialized)
+        return kSpErrorUninitialized;
+    stats.pumps++;
+
+    while (events_count) {
+        struct event event = events[events_head];
+        events_head = (events_head + 1) % MAX_EVENTS;
+        events_count--;
+        dispatch(&event);
+    }
+
+    deliver_audio();
+    return kSpErrorOk;
+}
+
+SpError SpGetMetadataValidRange(int *start, int *end)
+{
+    if (!start || !end)
+        return kSpErrorNullArgument;
+    if (!active)
+        return kSpErrorFailed;
+    *start = track > 0 ? -1 : 0;
+    *end = 2;
+    return kSpErrorOk;
+}
+
+SpError SpGetMetadata(SpMetadata *metadata, int offset)
+{
+    int index = (int)track + offset;
+
+    if (!metadata)
+        return kSpErrorNullArgument;
+    if (!active || offset < -1 || offset > 2 || index < 0)
+        return kSpErrorFailed;
+
+    memset(metadata, 0, sizeof(*metadata));
+    snprintf(metadata->context_uri, sizeof(metadata->context_uri), "spotify:user:standin:playlist:standin");
+    snprintf(metadata->track_name, sizeof(metadata->track_name), "Track %d", index + 1);
+    snprintf(metadata->track_uri, sizeof(metadata->track_uri), "spotify:track:standin%06d", index);
+    snprintf(metadata->artist_name, sizeof(metadata->artist_name), "Artist %d", index % 7 + 1);
+    snprintf(metadata->artist_uri, sizeof(metadata->artist_uri), "spotify:artist:standin%06d", index % 7);
+    snprintf(metadata->album_name, sizeof(metadata->album_name), "Album %d", index / 10 + 1);
+    snprintf(metadata->album_uri, sizeof(metadata->album_uri), "spotify:album:standin%06d", index / 10);
+    snprintf(metadata->cover_uri, sizeof(metadata->cover_uri), "spotify:image:standin%06d", index / 10);
+    metadata->duration = track_ms;
+    return kSpErrorOk;
+}
+
+SpError SpGetMetadataImageURL(const char *uri, SpImageSize imageSize, char *url, size_t size)
+{
+    static const int sizes[] = { 64, 300, 640 };
+
+    if (!uri || !url)
+        return kSpErrorNullArgument;
+    if (imageSize > kSpImageSizeLarge)
+        return kSpErrorInvalidArgument;
+    snprintf(url, size, "http://127.0.0.1/standin/%d/%s", sizes[imageSize], uri);
+    return kSpErrorOk;
+}
+
+SpError SpGetPreset(SpPreset *preset, size_t *size)
+{
+    if (!preset || !size)
+        return kSpErrorNullArgument;
+    memset(preset, 0, sizeof(*preset));
+    *size = sizeof(*preset);
+    return kSpErrorOk;
+}
+
+SpError SpPlayPreset(const SpPreset *preset, size_t size)
+{
+    if (!preset)
+        return kSpErrorNullArgument;
+    return SpPlaybackPlay();
+}
+
+SpError SpSetDisplayName(const char *name)
+{
+    if (!name)
+        return kSpErrorNullArgument;
+    snprintf(remote_name, sizeof(remote_name), "%s", name);
+    return kSpErrorOk;
+}
+
+const char *SpGetLibraryVersion(void)
+{
+    return "standin";
+}
+
+SpError SpZeroConfGetVars(SpZeroConfVars *vars)
+{
+    if (!vars)
+        return kSpErrorNullArgument;
+    memset(vars, 0, sizeof(*vars));
+    snprintf(vars->publicKey, sizeof(vars->publicKey), "standin");
+    snprintf(vars->deviceId, sizeof(vars->deviceId), "%s", config.deviceId ? config.deviceId : "");
+    snprintf(vars->activeUser, sizeof(vars->activeUser), "%s", logged_in ? username : "");
+    snprintf(vars->remoteName, sizeof(vars->remoteName), "%s", remote_name);
+    snprintf(vars->accountReq, sizeof(vars->accountReq), "PREMIUM");
+    snprintf(vars->deviceType, sizeof(vars->deviceType), "AUDIO_DONGLE");
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackPlay(void)
+{
+    if (!logged_in)
+        return kSpErrorNotActiveDevice;
+    if (!active) {
+        active = true;
+        push(EV_PLAYBACK, kSpPlaybackNotifyBecameActive);
+        push(EV_PLAYBACK, kSpPlaybackNotifyTrackChanged);
+    }
+    if (!playing) {
+        playing = true;
+        restart_clock();
+        push(EV_PLAYBACK, kSpPlaybackNotifyPlay);
+    }
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackPause(void)
+{
+    if (!active)
+        return kSpErrorNotActiveDevice;
+    if (playing) {
+        playing = false;
+        push(EV_PLAYBACK, kSpPlaybackNotifyPause);
+    }
+    return kSpErrorOk;
+}
+
+static SpError skip(uint32_t index, SpPlaybackNotify type)
+{
+    if (!active)
+        return kSpErrorNotActiveDevice;
+    start_track(index);
+    restart_clock();
+    push(EV_PLAYBACK, kSpPlaybackEventAudioFlush);
+    push(EV_PLAYBACK, kSpPlaybackNotifyTrackChanged);
+    push(EV_PLAYBACK, type);
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackSkipToNext(void)
+{
+    return skip(track + 1, kSpPlaybackNotifyNext);
+}
+
+SpError SpPlaybackSkipToPrev(void)
+{
+    return skip(track > 0 ? track - 1 : 0, kSpPlaybackNotifyPrev);
+}
+
+SpError SpPlaybackSeek(uint32_t millis)
+{
+    if (!active)
+        return kSpErrorNotActiveDevice;
+    if (millis >= track_ms)
+        return kSpErrorInvalidArgument;
+    track_frames = (uint64_t)millis * RATE / 1000;
+    chunk_offset = 0;
+    restart_clock();
+    push(EV_PLAYBACK, kSpPlaybackEventAudioFlush);
+    push(EV_SEEK, millis);
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackUpdateVolume(uint16_t value)
+{
+    volume = value;
+    push(EV_VOLUME, value);
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackEnableShuffle(bool enable)
+{
+    shuffled = enable;
+    push(EV_PLAYBACK, enable ? kSpPlaybackNotifyShuffleEnabled : kSpPlaybackNotifyShuffleDisabled);
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackEnableRepeat(bool enable)
+{
+    repeated = enable;
+    push(EV_PLAYBACK, enable ? kSpPlaybackNotifyRepeatEnabled : kSpPlaybackNotifyRepeatDisabled);
+    return kSpErrorOk;
+}
+
+SpError SpPlaybackSetBitrate(SpBitrate value)
+{
+    bitrate = value;
+    return kSpErrorOk;
+}
+
+uint16_t SpPlaybackGetVolume(void)
+{
+    return volume;
+}
+
+bool SpPlaybackIsPlaying(void)
+{
+    return playing;
+}
+
+bool SpPlaybackIsShuffled(void)
+{
+    return shuffled;
+}
+
+bool SpPlaybackIsRepeated(void)
+{
+    return repeated;
+}
+
+bool SpPlaybackIsActiveDevice(void)
+{
+    return active;
+}
+
+static SpError login(const char *name)
+{
+    if (!initialized)
+        return kSpErrorUninitialized;
+    if (!name)
+        return kSpErrorNullArgument;
+    snprintf(username, sizeof(username), "%s", name);
+    push(EV_LOGIN, 0);
+    return kSpErrorOk;
+}
+
+SpError SpConnectionLoginBlob(const char *name, const char *blob)
+{
+    return blob ? login(name) : kSpErrorNullArgument;
+}
+
+SpError SpConnectionLoginPassword(const char *name, const char *password)
+{
+    return password ? login(name) : kSpErrorNullArgument;
+}
+
+SpError SpConnectionLoginZeroConf(const char *name, const char *blob, const char *clientKey)
+{
+    return blob && clientKey ? login(name) : kSpErrorNullArgument;
+}
+
+SpError SpConnectionLoginOauthToken(const char *token)
+{
+    return token ? login("standin") : kSpErrorNullArgument;
+}
+
+bool SpConnectionIsLoggedIn(void)
+{
+    return logged_in;
+}
+
+SpError SpConnectionLogout(void)
+{
+    if (!logged_in)
+        return kSpErrorOk;
+    logged_in = false;
+    if (active) {
+        active = playing = false;
+        push(EV_PLAYBACK, kSpPlaybackNotifyBecameInactive);
+    }
+    push(EV_CONNECTION, kSpConnectionNotifyLoggedOut);
+    return kSpErrorOk;
+}
+
+SpError SpRegisterConnectionCallbacks(const SpConnectionCallbacks *callbacks, void *userdata)
+{
+    if (!callbacks)
+        return kSpErrorNullArgument;
+    connection_callbacks = *callbacks;
+    connection_userdata = userdata;
+    return kSpErrorOk;
+}
+
+SpError SpRegisterPlaybackCallbacks(const SpPlaybackCallbacks *callbacks, void *userdata)
+{
+    if (!callbacks)
+        return kSpErrorNullArgument;
+    playback_callbacks = *callbacks;
+    playback_userdata = userdata;
+    return kSpErrorOk;
+}
+
+SpError SpRegisterDebugCallbacks(const SpDebugCallbacks *callbacks, void *userdata)
+{
+    if (!callbacks)
+        return kSpErrorNullArgument;
+    debug_callbacks = *callbacks;
+    debug_userdata = userdata;
+    return kSpErrorOk;
+}
+
+/* Not part of spotify.h, read by the benchmarks through cffi's ABI mode */
+void standin_stats(StandinStats *out)
+{
+    *out = stats;
+}
+
+size_t standin_latencies(double *out, size_t size)
+{
+    if (size > latencies_count)
+        size = latencies_count;
+    memcpy(out, latencies, size * sizeof(double));
+    return size;
+}
+
+void standin_reset(void)
+{
+    memset(&stats, 0, sizeof(stats));
+    latencies_count = 0;
+}
@@ -0,0 +1,61 @@
+#Measures how long each stage of starting up takes to import, each in a fresh
+#interpreter so nothing is cached between runs. connect_ffi shows whether the
+#prebuilt _spotify_connect extension (python build_ffi.py) or ffi.verify was
+#used. Run from the repository root with libspotify available:
+#LD_LIBRARY_PATH=$PWD python benchmarks/startup.py
+import os
+import subprocess
+import sys
+
+RUNS = 5
+MODULES = [
+    'cffi',
+    'connect_ffi',
+    'console_callbacks',
+    'connect',
+    'numpy',
+    'flask',
+    'gevent',
+]
+
+TIMER = """
+import sys, time
+start = time.time()
+import {}
+sys.stderr.write('%r %r\\n' % (time.time() - start, '_spotify_connect' in sys.modules))
+"""
+
+#Seconds to import module in a new interpreter and whether the prebuilt
+#bindings were loaded, or None and the error if it failed
+def import_time(module):
+    process = subprocess.Popen([sys.executable, '-c', TIMER.format(module)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        return None, err.strip().splitlines()[-1]
+    seconds, prebuilt = err.strip().splitlines()[-1].split()
+    return float(seconds), prebuilt == 'True'
+
+def main():
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    print '{:<20} {:>10} {:>10}'.format('module', 'min (ms)', 'median (ms)')
+    for module in MODULES:
+        times = []
+        for run in xrange(RUNS):
+            seconds, result = import_time(module)
+            if seconds is None:
+                break
+            times.append(seconds * 1000)
+
+        if not times:
+            print '{:<20} {}'.format(module, result)
+            continue
+
+        times.sort()
+        print '{:<20} {:>10.1f} {:>10.1f}'.format(module, times[0], times[len(times) / 2])
+        if module == 'connect_ffi':
+            mode = 'prebuilt _spotify_connect' if result else 'ffi.verify'
+            print '{:<20} {}'.format('', mode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#Builds the libspotify bindings ahead of time as the _spotify_connect
+#extension, so starting up doesn't have to parse the header or run the
+#compiler. Run once after installing, and again after updating cffi or the
+#headers: python build_ffi.py
+from cffi import FFI
+
+SOURCE = """
+    #include <stdlib.h>
+    #include "spotify.h"
+"""
+
+ffibuilder = FFI()
+
+#Header generated with cpp spotify.h > spotify.processed.h && sed -i 's/__extension__//g' spotify.processed.h
+with open("spotify.processed.h") as file:
+    ffibuilder.cdef(file.read())
+
+ffibuilder.cdef("""
+void *malloc(size_t size);
+void exit(int status);
+""")
+
+ffibuilder.set_source("_spotify_connect", SOURCE,
+    include_dirs=['./'],
+    library_dirs=['./'],
+    libraries=[str('spotify_embedded_shared')])
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
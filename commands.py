@@ -0,0 +1,60 @@
+import time
+import metrics
+from collections import OrderedDict
+from gevent.event import AsyncResult
+
+class Command:
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.futures = []
+        self.queued_at = time.time()
+
+class CommandQueue:
+    # Control requests from the web server, run in order by the pump loop
+    # between SpPumpEvents calls instead of calling into libspotify from the
+    # request greenlets. A command queued while one with the same key is still
+    # waiting replaces it, or is merged into it if merge is given, so a burst
+    # of clicks costs one native call. Either way it moves to the end of the
+    # queue, so it still runs after everything queued before it. Every caller
+    # gets an AsyncResult with the command's return value.
+    def __init__(self, wakeup=None):
+        #Called after queueing, to get the pump to run sooner
+        self.wakeup = wakeup
+        self.pending = OrderedDict()
+
+    def put(self, key, function, args=(), merge=None):
+        command = self.pending.get(key)
+        if command is None:
+            command = self.pending[key] = Command(function, args)
+        else:
+            command.function = function
+            command.args = merge(command.args, args) if merge is not None else args
+            self.pending[key] = self.pending.pop(key)
+            metrics.commands_coalesced.inc()
+
+        future = AsyncResult()
+        command.futures.append(future)
+        metrics.command_queue_depth.set(len(self.pending))
+        if self.wakeup is not None:
+            self.wakeup()
+        return future
+
+    def depth(self):
+        return len(self.pending)
+
+    #Runs everything queued so far, called from the pump loop
+    def run(self):
+        while self.pending:
+            key, command = self.pending.popitem(last=False)
+            metrics.command_queue_depth.set(len(self.pending))
+            try:
+                result = command.function(*command.args)
+            except Exception as error:
+                print "Command {} failed: {}".format(key, error)
+                for future in command.futures:
+                    future.set_exception(error)
+            else:
+                for future in command.futures:
+                    future.set(result)
+            metrics.command_duration.time(command.queued_at)
@@ -4,10 +4,13 @@ import signal
 import sys
 import json
 import uuid
+import time
 import player
+import realtime
 from connect_ffi import ffi, lib, C
-from console_callbacks import audio_arg_parser, audio_player, play_event, pause_event, error_callback, connection_callbacks, debug_callbacks, playback_callbacks
+from console_callbacks import audio_arg_parser, audio_player, set_latency, play_event, pause_event, error_callback, connection_callbacks, debug_callbacks, playback_callbacks
 from utils import print_zeroconf_vars
+from pump import Pump
 
 class Connect:
     def __init__(self, error_cb = error_callback):
@@ -23,11 +26,33 @@ class Connect:
         arg_parser.add_argument('--name', '-n', help='name that shows up in the spotify client', default='TestConnect')
         arg_parser.add_argument('--bitrate', '-b', help='Sets bitrate of audio stream (may not actually work)', choices=[90, 160, 320], type=int, default=160)
         arg_parser.add_argument('--credentials', '-c', help='File to load and save credentials from/to', default='credentials.json')
+        arg_parser.add_argument('--image-cache', help='directory to cache album art in', default='image_cache')
+        arg_parser.add_argument('--image-cache-size', help='maximum size of the album art cache (MB)', type=int, default=32)
         self.args = arg_parser.parse_args()
         
         if self.args.volmin >= self.args.volmax:
             arg_parser.error('--volmin/-v must be less than --volmax/-V')
 
+        if self.args.output != 'alsa':
+            if self.args.nonblock or self.args.mmap:
+                arg_parser.error('--nonblock and --mmap only work with the alsa output')
+            if self.args.output not in ('stdout', 'null') and not self.args.device:
+                arg_parser.error('--device is required for the {} output'.format(self.args.output))
+
+        if self.args.audio_process and self.args.mmap:
+            arg_parser.error('--mmap writes to the device from the libspotify callback, it can\'t be used with --audio-process')
+
+        if self.args.mmap and (self.args.realtime or self.args.audio_cpus is not None):
+            arg_parser.error('--realtime and --audio-cpus apply to the playback threads, which --mmap does without')
+
+        #Before the mixer threads start, so they inherit it
+        realtime.apply_web(self.args.web_cpus, self.args.mlock and not self.args.audio_process)
+
+        try:
+            set_latency(self.args.latency, self.args.period_time, self.args.buffer_time)
+        except ValueError as error:
+            arg_parser.error(error)
+
         app_key = ffi.new('uint8_t *')
         self.args.key.readinto(ffi.buffer(app_key))
         app_key_size = len(self.args.key.read()) + 1
@@ -75,17 +100,20 @@ class Connect:
             lib.SpRegisterDebugCallbacks(debug_callbacks, userdata)
         lib.SpRegisterPlaybackCallbacks(playback_callbacks, userdata)
         
-        try:
-            if self.args.mixer is None:
-                audio_player.mixer_load(volmin=self.args.volmin, volmax=self.args.volmax)
-            else:
-                audio_player.mixer_load(self.args.mixer, self.args.volmin, self.args.volmax)
-        except player.PlayerError as error:
-            print error
+        if not self.args.softvol:
+            try:
+                if self.args.mixer is None:
+                    audio_player.mixer_load(volmin=self.args.volmin, volmax=self.args.volmax)
+                else:
+                    audio_player.mixer_load(self.args.mixer, self.args.volmin, self.args.volmax)
+            except player.PlayerError as error:
+                print error
             
         if audio_player.mixer_loaded():
-            volume = int(audio_player.volume_get() * 655.35)
-            lib.SpPlaybackUpdateVolume(volume)
+            lib.SpPlaybackUpdateVolume(audio_player.volume_get())
+
+        #Fall back to software volume when there is no usable mixer
+        audio_player.dsp_load(self.args.gain, self.args.limiter, self.args.mix)
 
         bitrates = {
             90: lib.kSpBitrate90k,
@@ -133,11 +161,18 @@ class Connect:
                 audio_player.play()
         elif pause_event.is_set() and audio_player.playing():
             audio_player.pause()
-            audio_player.release()
-            print "DeviceReleased"
                 
         play_event.clear()
         pause_event.clear()
+
+        self.check_idle()
+
+    #Keeping the device open across pauses and track changes avoids
+    #reconfiguring it (and the clicks that come with that) on every skip
+    def check_idle(self):
+        if audio_player.acquired() and not audio_player.playing() and audio_player.idle_time() >= self.args.idle_release:
+            audio_player.release()
+            print "DeviceReleased"
     
 def signal_handler(signal, frame):
         lib.SpConnectionLogout()
@@ -149,7 +184,7 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 #Only run if script is run directly and not by an import
 if __name__ == "__main__":
-    @ffi.callback('void(SpError err, void *userdata)')
+    @ffi.callback('void(SpError, void *)')
     def console_error_callback(error, userdata):
         if error == lib.kSpErrorLoginBadCredentials:
             print 'Invalid username or password'
@@ -159,6 +194,4 @@ if __name__ == "__main__":
             error_callback(msg)
     connect = Connect(console_error_callback)
 
-    while 1:
-        lib.SpPumpEvents()
-        connect.check_events()
+    Pump(connect).run(time.sleep)
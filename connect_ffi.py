@@ -1,19 +1,15 @@
-from cffi import FFI
-ffi = FFI()
+try:
+    #Built by build_ffi.py, loads without parsing the header or compiling
+    from _spotify_connect import ffi, lib
+    #malloc and exit are part of the compiled module
+    C = lib
+except ImportError:
+    import sys
+    from build_ffi import ffibuilder as ffi, SOURCE
 
-#Header generated with cpp spotify.h > spotify.processed.h && sed -i 's/__extension__//g' spotify.processed.h
-with open("spotify.processed.h") as file:
-    header = file.read()
-
-ffi.cdef(header)
-ffi.cdef("""
-void *malloc(size_t size);
-void exit(int status);
-""")
-
-C = ffi.dlopen(None)
-lib = ffi.verify("""
-    #include "spotify.h"
-""", include_dirs=['./'],
-    library_dirs=['./'],
-    libraries=[str('spotify_embedded_shared')])
\ No newline at end of file
+    #On stderr, it comes before --output stdout can move fd 1 out of the way
+    print >> sys.stderr, "connect_ffi: _spotify_connect not built, run python build_ffi.py for a faster start"
+    C = ffi.dlopen(None)
+    lib = ffi.verify(SOURCE, include_dirs=['./'],
+        library_dirs=['./'],
+        libraries=[str('spotify_embedded_shared')])
@@ -1,27 +1,140 @@
 import argparse
 import json
+import time
 import player
+import realtime
+from fanout import FanOut
+from sinks import SINKS, take_stdout
+import metrics
 from threading import Event
 from connect_ffi import ffi, lib
 
 RATE = 44100
 CHANNELS = 2
-PERIODSIZE = 44100 / 40 # 0.025s
 SAMPLESIZE = 2 # 16 bit integer
-MAXPERIODS = int(0.5 * RATE / PERIODSIZE) # 0.5s Buffer
+
+#period_time: size of each write to alsa (ms)
+#buffer_time: audio buffered ahead of alsa (ms)
+#periods: number of periods in the alsa hardware buffer
+LATENCY_PROFILES = {
+    'low': {'period_time': 10, 'buffer_time': 100, 'periods': 2},
+    'default': {'period_time': 25, 'buffer_time': 500, 'periods': 4},
+    'robust': {'period_time': 100, 'buffer_time': 2000, 'periods': 4},
+}
 
 audio_arg_parser = argparse.ArgumentParser(add_help=False)
-audio_arg_parser.add_argument('--device', '-D', help='alsa output device', default='default')
+audio_arg_parser.add_argument('--output', '-o', help='where audio goes, --device is the alsa device, file path or host:port', choices=['alsa'] + sorted(SINKS), default='alsa')
+audio_arg_parser.add_argument('--device', '-D', help='alsa output device, repeat to play on several devices at once. An optional @DELAY (ms) delays that device to line it up with slower ones', metavar='DEVICE[@DELAY]', action='append')
 audio_arg_parser.add_argument('--mixer', '-m', help='alsa mixer name for volume control')
 audio_arg_parser.add_argument('--volmin', '-v', help='minimum mixer volume (percentage)', metavar='{0-99}', choices=xrange(0, 100), type=int, default=0)
 audio_arg_parser.add_argument('--volmax', '-V', help='maximum mixer volume (percentage)', metavar='{1-100}', choices=xrange(1, 101), type=int, default=100)
+audio_arg_parser.add_argument('--latency', '-l', help='audio latency profile', choices=sorted(LATENCY_PROFILES), default='default')
+audio_arg_parser.add_argument('--period-time', help='override the period time of the latency profile (ms)', type=int)
+audio_arg_parser.add_argument('--buffer-time', help='override the buffer time of the latency profile (ms)', type=int)
+audio_arg_parser.add_argument('--softvol', help='control volume in software even if the device has a mixer', action='store_true')
+audio_arg_parser.add_argument('--gain', help='gain applied to all audio, e.g. for normalization (dB)', type=float, default=0.0)
+audio_arg_parser.add_argument('--limiter', help='soft clip peaks pushed over full scale by --gain', action='store_true')
+audio_arg_parser.add_argument('--mix', help='channel mixing', choices=['stereo', 'mono', 'swap'], default='stereo')
+audio_arg_parser.add_argument('--nonblock', help='write to alsa from a poll loop instead of blocking once per period', action='store_true')
+audio_arg_parser.add_argument('--mmap', help='copy audio straight into the mmapped alsa buffer, which replaces the ring buffer', action='store_true')
+audio_arg_parser.add_argument('--audio-process', help='play audio from a separate process, so a busy web server can\'t hold it up', action='store_true')
+audio_arg_parser.add_argument('--realtime', help='run the playback threads with this real-time scheduling policy', choices=['fifo', 'rr'])
+audio_arg_parser.add_argument('--realtime-priority', help='real-time priority of the playback threads', metavar='{1-99}', choices=xrange(1, 100), type=int, default=50)
+audio_arg_parser.add_argument('--audio-cpus', help='CPUs the playback threads (or the audio process) run on, e.g. 2,3 or 2-3', type=realtime.parse_cpus)
+audio_arg_parser.add_argument('--web-cpus', help='CPUs the web server, pump loop and everything else run on', type=realtime.parse_cpus)
+audio_arg_parser.add_argument('--mlock', help='lock memory so the audio path is never paged out (the audio process only with --audio-process)', action='store_true')
+audio_arg_parser.add_argument('--idle-release', help='seconds to keep the alsa device open after playback stops', type=float, default=10)
 args = audio_arg_parser.parse_known_args()[0]
+if args.output == 'stdout':
+    take_stdout()
+realtime.configure(args.realtime, args.realtime_priority, args.audio_cpus, args.mlock)
+
+latency = dict(LATENCY_PROFILES['default'], profile='default')
+
+def create_player(device):
+    if args.audio_process:
+        #Only imported when needed, it pulls in multiprocessing
+        from engine import ProcessPlayer
+        cls = ProcessPlayer
+    else:
+        cls = player.Player
+    return cls(device, RATE, CHANNELS,
+            RATE * latency['period_time'] / 1000,
+            latency['buffer_time'] / latency['period_time'],
+            latency['periods'], args.nonblock, args.mmap, args.output)
+
+#name@delay, with the delay in ms
+def parse_device(device):
+    name, _, delay = device.rpartition('@')
+    if not name or not delay.isdigit():
+        return device, 0
+    return name, RATE * int(delay) / 1000
+
+devices = [parse_device(device) for device in args.device or ['default']]
+if len(devices) == 1 and devices[0][1] == 0:
+    audio_player = create_player(devices[0][0])
+else:
+    audio_player = FanOut([(create_player(name), delay) for name, delay in devices])
+
+def set_latency(profile, period_time=None, buffer_time=None):
+    global latency
+
+    if profile not in LATENCY_PROFILES:
+        raise ValueError('Unknown latency profile {}'.format(profile))
+
+    settings = dict(LATENCY_PROFILES[profile], profile=profile)
+    if period_time is not None:
+        settings['period_time'] = period_time
+    if buffer_time is not None:
+        settings['buffer_time'] = buffer_time
+
+    if settings['period_time'] <= 0:
+        raise ValueError('period time must be positive')
+    if settings['buffer_time'] < settings['period_time']:
+        raise ValueError('buffer time must be at least the period time')
 
-audio_player = player.Player(args.device, RATE, CHANNELS, PERIODSIZE, MAXPERIODS)
+    audio_player.set_latency(RATE * settings['period_time'] / 1000,
+            settings['buffer_time'] / settings['period_time'],
+            settings['periods'])
+    latency = settings
+
+#Requested latency settings, plus the values negotiated with alsa once the
+#device has been opened
+def get_latency():
+    res = dict(latency)
+    hw_params = audio_player.hw_params()
+    if hw_params is not None:
+        res['alsa'] = {
+            'period_time': hw_params['periodsize'] * 1000.0 / hw_params['rate'],
+            'buffer_time': hw_params['buffersize'] * 1000.0 / hw_params['rate'],
+            'periodsize': hw_params['periodsize'],
+            'periods': hw_params['periods'],
+            'buffersize': hw_params['buffersize'],
+        }
+    else:
+        res['alsa'] = None
+    return res
 
 play_event = Event()
 pause_event = Event()
 
+#Functions called with no arguments after every connection, playback or
+#volume notification. They run inside SpPumpEvents, so they shouldn't call
+#back into libspotify.
+notify_listeners = []
+
+def notify():
+    for listener in notify_listeners:
+        listener()
+
+#Bumped whenever the track metadata or volume may have changed, so readers
+#can tell whether a cached copy is still valid
+metadata_version = 0
+
+def metadata_changed():
+    global metadata_version
+    metadata_version += 1
+
 def userdata_wrapper(f):
     def inner(*args):
         assert len(args) > 0
@@ -30,24 +143,27 @@ def userdata_wrapper(f):
     return inner
 
 #Error callbacks
-@ffi.callback('void(SpError error, void *userdata)')
+@ffi.callback('void(SpError, void *)')
 def error_callback(error, userdata):
     print "error_callback: {}".format(error)
 
 #Connection callbacks
-@ffi.callback('void(SpConnectionNotify type, void *userdata)')
+@ffi.callback('void(SpConnectionNotify, void *)')
 @userdata_wrapper
 def connection_notify(self, type):
     if type == lib.kSpConnectionNotifyLoggedIn:
         print "kSpConnectionNotifyLoggedIn"
+        metadata_changed()
     elif type == lib.kSpConnectionNotifyLoggedOut:
         print "kSpConnectionNotifyLoggedOut"
+        metadata_changed()
     elif type == lib.kSpConnectionNotifyTemporaryError:
         print "kSpConnectionNotifyTemporaryError"
     else:
         print "UNKNOWN ConnectionNotify {}".format(type)
+    notify()
 
-@ffi.callback('void(const char *blob, void *userdata)')
+@ffi.callback('void(char const *, void *)')
 @userdata_wrapper
 def connection_new_credentials(self, blob):
     print ffi.string(blob)
@@ -57,26 +173,31 @@ def connection_new_credentials(self, blob):
         f.write(json.dumps(self.credentials))
 
 #Debug callbacks
-@ffi.callback('void(const char *msg, void *userdata)')
+@ffi.callback('void(char const *, void *)')
 @userdata_wrapper
 def debug_message(self, msg):
     print ffi.string(msg)
 
 #Playback callbacks
-@ffi.callback('void(SpPlaybackNotify type, void *userdata)')
+@ffi.callback('void(SpPlaybackNotify, void *)')
 @userdata_wrapper
 def playback_notify(self, type):
     if type == lib.kSpPlaybackNotifyPlay:
         print "kSpPlaybackNotifyPlay"
+        metadata_changed()
     elif type == lib.kSpPlaybackNotifyPause:
         print "kSpPlaybackNotifyPause"
         pause_event.set()
     elif type == lib.kSpPlaybackNotifyTrackChanged:
         print "kSpPlaybackNotifyTrackChanged"
+        audio_player.position.reset(0)
+        metadata_changed()
     elif type == lib.kSpPlaybackNotifyNext:
         print "kSpPlaybackNotifyNext"
+        metadata_changed()
     elif type == lib.kSpPlaybackNotifyPrev:
         print "kSpPlaybackNotifyPrev"
+        metadata_changed()
     elif type == lib.kSpPlaybackNotifyShuffleEnabled:
         print "kSpPlaybackNotifyShuffleEnabled"
     elif type == lib.kSpPlaybackNotifyShuffleDisabled:
@@ -87,8 +208,10 @@ def playback_notify(self, type):
         print "kSpPlaybackNotifyRepeatDisabled"
     elif type == lib.kSpPlaybackNotifyBecameActive:
         print "kSpPlaybackNotifyBecameActive"
+        metadata_changed()
     elif type == lib.kSpPlaybackNotifyBecameInactive:
         print "kSpPlaybackNotifyBecameInactive"
+        metadata_changed()
         pause_event.set()
     elif type == lib.kSpPlaybackNotifyPlayTokenLost:
         print "kSpPlaybackNotifyPlayTokenLost"
@@ -97,52 +220,51 @@ def playback_notify(self, type):
         audio_flush()
     else:
         print "UNKNOWN PlaybackNotify {}".format(type)
+    notify()
         
 def audio_flush():
-    global pending_data
-    
     audio_player.buffer_flush()
-    pending_data = str()
-    
-pending_data = str()
 
-@ffi.callback('uint32_t(const void *data, uint32_t num_samples, SpSampleFormat *format, uint32_t *pending, void *userdata)')
+@ffi.callback('uint32_t(void const *, uint32_t, SpSampleFormat *, uint32_t *, void *)')
 @userdata_wrapper
 def playback_data(self, data, num_samples, format, pending):
-    global pending_data
-    
-    play_event.set()
+    start = time.time()
+    if not audio_player.playing():
+        play_event.set()
     
     # Make sure we don't pass incomplete frames to alsa
     num_samples -= num_samples % CHANNELS
 
-    buf = pending_data + ffi.buffer(data, num_samples * SAMPLESIZE)[:]
+    # Copied straight from libspotify's buffer into the player's ring buffer
+    accepted = audio_player.write(ffi.buffer(data, num_samples * SAMPLESIZE)) / SAMPLESIZE
+
+    #Includes what alsa still has queued, so libspotify's position is exact
+    buffered = audio_player.buffer_length()
+    pending[0] = (buffered + audio_player.device_delay()) * CHANNELS
 
-    try:
-        total = 0
-        while len(buf) >= PERIODSIZE * CHANNELS * SAMPLESIZE:
-            audio_player.write(buf[:PERIODSIZE * CHANNELS * SAMPLESIZE])
-            buf = buf[PERIODSIZE * CHANNELS * SAMPLESIZE:]
-            total += PERIODSIZE * CHANNELS
+    metrics.samples_offered.inc(num_samples)
+    metrics.samples_accepted.inc(accepted)
+    if accepted < num_samples:
+        metrics.buffer_full.inc()
+    metrics.buffer_frames.set(buffered)
+    metrics.buffer_depth.observe(buffered / float(audio_player.buffer_capacity()))
+    metrics.callback_duration.time(start)
 
-        pending_data = buf
-        return num_samples
-    except player.BufferFull:
-        return total
-    finally:
-        pending[0] = audio_player.buffer_length() * PERIODSIZE * CHANNELS
+    return accepted
 
-@ffi.callback('void(uint32_t millis, void *userdata)')
+@ffi.callback('void(uint32_t, void *)')
 @userdata_wrapper
 def playback_seek(self, millis):
     print "playback_seek: {}".format(millis)
+    audio_player.position.reset(millis)
 
-@ffi.callback('void(uint16_t volume, void *userdata)')
+@ffi.callback('void(uint16_t, void *)')
 @userdata_wrapper
 def playback_volume(self, volume):
     print "playback_volume: {}".format(volume)
-    if audio_player.mixer_loaded():
-        audio_player.volume_set(int(volume / 655.35))
+    audio_player.volume_set(volume)
+    metadata_changed()
+    notify()
 
 connection_callbacks = ffi.new('SpConnectionCallbacks *', [
     connection_notify,
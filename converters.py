@@ -0,0 +1,45 @@
+#Builds a converter from a cffi struct to a python dict once per struct type,
+#with every field access unrolled, instead of inspecting the struct layout on
+#every call. The layouts in spotify.h never change at runtime.
+
+def compile_converter(ffi, ctype, _converters=None):
+    if _converters is None:
+        _converters = {}
+
+    ctype = ffi.typeof(ctype)
+    if ctype.kind == 'pointer':
+        ctype = ctype.item
+    if ctype.kind != 'struct':
+        raise TypeError('Can only compile converters for structs, not {}'.format(ctype.cname))
+    if ctype.cname in _converters:
+        return _converters[ctype.cname]
+
+    namespace = {'string': ffi.string}
+    items = []
+    for field, fieldtype in ctype.fields:
+        items.append('        {!r}: {},'.format(field,
+            _field_expression(ffi, 's.' + field, fieldtype.type, namespace, _converters)))
+
+    source = 'def convert(s):\n    return {\n' + '\n'.join(items) + '\n    }\n'
+    exec source in namespace
+    converter = namespace['convert']
+    _converters[ctype.cname] = converter
+    return converter
+
+def _field_expression(ffi, expr, fieldtype, namespace, converters):
+    if fieldtype.kind in ('primitive', 'enum'):
+        return expr
+    elif fieldtype.kind == 'struct':
+        name = 'convert_' + str(len(namespace))
+        namespace[name] = compile_converter(ffi, fieldtype, converters)
+        return '{}({})'.format(name, expr)
+    elif fieldtype.kind == 'array':
+        if fieldtype.item.kind == 'primitive' and fieldtype.item.cname == 'char':
+            return 'string({})'.format(expr)
+        elif fieldtype.item.kind in ('primitive', 'enum'):
+            return 'list({})'.format(expr)
+        else:
+            item = _field_expression(ffi, 'item', fieldtype.item, namespace, converters)
+            return '[{} for item in {}]'.format(item, expr)
+    else:
+        raise TypeError('Unsupported struct field type {}'.format(fieldtype.cname))
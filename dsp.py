@@ -0,0 +1,97 @@
+import audioop
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SAMPLEWIDTH = 2 # S16
+FULL_SCALE = 32767.0
+#Peaks above this fraction of full scale are compressed by the limiter
+LIMITER_THRESHOLD = 0.8
+#Sub-blocks per period used to approximate gain ramps without numpy
+RAMP_STEPS = 8
+
+#Processes S16 stereo audio in place, a whole period at a time, from the
+#playback thread. Uses numpy when it's installed and audioop otherwise, which
+#steps gain ramps and hard clips instead of limiting.
+class DSP:
+    def __init__(self, channels, gain_db=0.0, limiter=False, mix='stereo'):
+        self.channels = channels
+        self.preamp = 10 ** (gain_db / 20.0)
+        self.limiter = limiter
+        self.mix = mix
+        self.volume = 1.0
+        #Gain applied at the end of the last period, ramped towards target
+        self.gain = self.preamp
+        self.target = self.preamp
+
+    #volume is in the range 0..1. Cubic, so the slider feels like alsamixer's
+    def set_volume(self, volume):
+        self.volume = volume
+        self.target = volume ** 3 * self.preamp
+
+    def idle(self, target):
+        return self.gain == target == 1.0 and self.mix == 'stereo'
+
+    def process(self, data, offset, length):
+        #set_volume runs on another thread, a change made while this period
+        #is processed is ramped to in the next one
+        target = self.target
+        if self.idle(target):
+            return
+
+        if numpy is not None:
+            self.process_numpy(data, offset, length, target)
+        else:
+            self.process_audioop(data, offset, length, target)
+        self.gain = target
+
+    def process_numpy(self, data, offset, length, target):
+        samples = numpy.frombuffer(data, numpy.int16, length / SAMPLEWIDTH, offset).reshape(-1, self.channels)
+        frames = samples.astype(numpy.float32)
+
+        if self.mix == 'mono':
+            frames[:] = frames.mean(axis=1)[:, numpy.newaxis]
+        elif self.mix == 'swap':
+            frames = frames[:, ::-1]
+
+        if self.gain != target:
+            frames *= numpy.linspace(self.gain, target, len(frames), dtype=numpy.float32)[:, numpy.newaxis]
+        elif self.gain != 1.0:
+            frames *= self.gain
+
+        if self.limiter and max(self.gain, target) > 1.0:
+            threshold = LIMITER_THRESHOLD * FULL_SCALE
+            over = numpy.abs(frames) > threshold
+            if over.any():
+                peaks = frames[over]
+                knee = FULL_SCALE - threshold
+                frames[over] = numpy.sign(peaks) * (threshold + knee * numpy.tanh((numpy.abs(peaks) - threshold) / knee))
+
+        samples[:] = numpy.clip(frames, -FULL_SCALE - 1, FULL_SCALE)
+
+    def process_audioop(self, data, offset, length, target):
+        fragment = bytes(data[offset:offset + length])
+
+        if self.mix == 'mono':
+            mono = audioop.tomono(fragment, SAMPLEWIDTH, 0.5, 0.5)
+            fragment = audioop.tostereo(mono, SAMPLEWIDTH, 1, 1)
+        elif self.mix == 'swap':
+            left = audioop.tomono(fragment, SAMPLEWIDTH, 1, 0)
+            right = audioop.tomono(fragment, SAMPLEWIDTH, 0, 1)
+            fragment = audioop.add(audioop.tostereo(right, SAMPLEWIDTH, 1, 0),
+                                   audioop.tostereo(left, SAMPLEWIDTH, 0, 1), SAMPLEWIDTH)
+
+        if self.gain != target:
+            framesize = SAMPLEWIDTH * self.channels
+            step = length / framesize / RAMP_STEPS * framesize
+            blocks = []
+            for i in xrange(RAMP_STEPS):
+                end = length if i == RAMP_STEPS - 1 else (i + 1) * step
+                gain = self.gain + (target - self.gain) * (i + 1) / float(RAMP_STEPS)
+                blocks.append(audioop.mul(fragment[i * step:end], SAMPLEWIDTH, gain))
+            fragment = ''.join(blocks)
+        elif self.gain != 1.0:
+            fragment = audioop.mul(fragment, SAMPLEWIDTH, self.gain)
+
+        data[offset:offset + length] = fragment
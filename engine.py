@@ -0,0 +1,525 @@
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+import select
+import signal
+import struct
+import tempfile
+import time
+import metrics
+import realtime
+from multiprocessing import Pipe, Process
+from threading import Lock, Thread
+from player import Player, PlayerError
+from position import PositionTracker
+
+#Ring buffers are files here when possible, so they never touch a disk
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+#Bytes in front of the audio in the shared ring, the tail and the head each on
+#a cache line of their own
+HEADER = 128
+TAIL_OFFSET = 0
+HEAD_OFFSET = 64
+#Counts in the header are kept modulo 2**32, a 4 byte store can't be seen
+#half done
+COUNT = struct.Struct('=I')
+DOORBELL = struct.Struct('=Q')
+#Seconds the audio process waits for the doorbell before checking again
+WAIT_TIMEOUT = 0.1
+#Seconds between checks for volume changes made by another program
+MIXER_POLL = 0.05
+#Seconds to wait for the audio process to answer a call
+CALL_TIMEOUT = 5
+
+class SharedRing:
+    # RingBuffer split across two processes: a RingWriter in the process
+    # running libspotify and a RingReader in the audio process. The audio is
+    # in an mmap of a file both open. Nothing is locked, the head is sent over
+    # the doorbell pipe once the data is in place, so the reader can't see the
+    # head ahead of the data, and the reader stores the tail in the mmap after
+    # the device has taken the data. The head is stored in the mmap as well,
+    # for counting what is buffered without reading the doorbell.
+    def __init__(self, path, periodsize, periods, framesize, doorbell):
+        self.path = path
+        self.periodsize = periodsize
+        self.framesize = framesize
+        self.size = periodsize * periods
+        self.doorbell = doorbell
+
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self.map = mmap.mmap(fd, HEADER + self.size)
+        finally:
+            os.close(fd)
+        #ctypes gives a writable buffer for the mmap, which python 2 lacks
+        self.data = (ctypes.c_char * self.size).from_buffer(self.map, HEADER)
+        self.view = memoryview(self.data)
+
+        self.head = 0
+        self.tail = 0
+
+    #Offset in data of the bytes returned by read() or peek()
+    def offset(self):
+        return self.tail % self.size
+
+    #Bytes between the tail and the head in the header
+    def shared_length(self):
+        head, = COUNT.unpack_from(self.map, HEAD_OFFSET)
+        tail, = COUNT.unpack_from(self.map, TAIL_OFFSET)
+        return (head - tail) % 2**32
+
+class RingWriter(SharedRing):
+    # The producer side, written from playback_data
+    @classmethod
+    def create(cls, periodsize, periods, framesize, doorbell):
+        fd, path = tempfile.mkstemp(prefix='spotify-ring-', dir=SHM_DIR)
+        try:
+            os.ftruncate(fd, HEADER + periodsize * periods)
+        finally:
+            os.close(fd)
+        return cls(path, periodsize, periods, framesize, doorbell)
+
+    def write(self, data):
+        src = memoryview(data)
+        length = min(len(src), self.size - self.length())
+        # Never store incomplete frames
+        length -= length % self.framesize
+
+        start = self.head % self.size
+        first = min(length, self.size - start)
+        self.view[start:start + first] = src[:first]
+        if length > first:
+            self.view[:length - first] = src[first:length]
+
+        if length:
+            self.head += length
+            COUNT.pack_into(self.map, HEAD_OFFSET, self.head % 2**32)
+            try:
+                os.write(self.doorbell, DOORBELL.pack(self.head))
+            except OSError as error:
+                #The pipe only fills up if the audio process stopped reading,
+                #it catches up with the next head sent
+                if error.errno != errno.EAGAIN:
+                    raise
+        return length
+
+    def length(self):
+        return self.shared_length()
+
+class RingReader(SharedRing):
+    # The consumer side, in the audio process, with the same interface as
+    # RingBuffer has for the playback threads
+    def __init__(self, path, periodsize, periods, framesize, doorbell):
+        SharedRing.__init__(self, path, periodsize, periods, framesize, doorbell)
+        self.poller = select.poll()
+        self.poller.register(doorbell[0], select.POLLIN)
+        #Anything left in the pipe was meant for the ring this one replaces
+        while self.poller.poll(0):
+            self.receive(0)
+        self.head = 0
+
+    #Takes the newest head from the doorbell, waiting up to timeout (s)
+    def receive(self, timeout):
+        if not self.poller.poll(timeout * 1000):
+            return
+        try:
+            messages = os.read(self.doorbell[0], 4096)
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+            return
+        for start in xrange(0, len(messages) - DOORBELL.size + 1, DOORBELL.size):
+            self.head = max(self.head, DOORBELL.unpack_from(messages, start)[0])
+
+    # Blocks until a whole period is buffered or stop is set, returns False
+    # if stopped
+    def wait(self, stop):
+        self.receive(0)
+        while self.head - self.tail < self.periodsize and not stop.is_set():
+            self.receive(WAIT_TIMEOUT)
+        return not stop.is_set()
+
+    def read(self, stop, periods=1):
+        if not self.wait(stop):
+            return None
+
+        length = min(periods, (self.head - self.tail) // self.periodsize) * self.periodsize
+        start = self.offset()
+        first = min(length, self.size - start)
+        views = [self.view[start:start + first]]
+        if length > first:
+            views.append(self.view[:length - first])
+        return views
+
+    def peek(self, length):
+        start = self.offset()
+        length = min(length, self.head - self.tail, self.size - start)
+        length -= length % self.framesize
+        return self.view[start:start + length]
+
+    def consume(self, length):
+        self.tail += length
+        COUNT.pack_into(self.map, TAIL_OFFSET, self.tail % 2**32)
+
+    #Head 0 never moves the head, it only ends a wait
+    def wakeup(self):
+        try:
+            os.write(self.doorbell[1], DOORBELL.pack(0))
+        except OSError as error:
+            #A full pipe wakes the wait up just as well
+            if error.errno != errno.EAGAIN:
+                raise
+
+    # Discards everything written so far, or up to head, the writer's head
+    # when it flushed. Flushes don't wait for the audio process, so the
+    # writer may have written more since.
+    def clear(self, head=None):
+        while self.poller.poll(0):
+            self.receive(0)
+        if head is None:
+            head = self.head
+        #In case the doorbell is behind
+        self.head = max(self.head, head)
+        self.consume(max(head - self.tail, 0))
+
+    #Only the playback thread reads the doorbell, anything else asking
+    #goes by the header
+    def length(self):
+        return self.shared_length()
+
+class Events:
+    # Sends what happens in the audio process to the ProcessPlayer, from any
+    # of its threads
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = Lock()
+
+    def send(self, *message):
+        with self.lock:
+            try:
+                self.connection.send(message)
+            except IOError:
+                #The parent is gone and this process is on its way out
+                pass
+
+class ForwardedMetric:
+    # Takes the place of a metrics object in the audio process, the updates
+    # are applied to the real one by the ProcessPlayer
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+
+    def inc(self, amount=1):
+        self.events.send('metric', self.name, 'inc', amount)
+
+    def observe(self, value):
+        self.events.send('metric', self.name, 'observe', value)
+
+    def time(self, start):
+        self.observe(time.time() - start)
+
+class ForwardedPosition(PositionTracker):
+    # Sends every change to the ProcessPlayer's PositionTracker as well
+    def __init__(self, rate, events):
+        PositionTracker.__init__(self, rate)
+        self.events = events
+
+    def delivered(self, frames, queued, at=None):
+        PositionTracker.delivered(self, frames, queued, at)
+        self.events.send('delivered', frames, queued, self.state[2])
+
+    def dropped(self, queued):
+        PositionTracker.dropped(self, queued)
+        self.events.send('dropped', queued)
+
+    def paused(self, queued, at=None):
+        PositionTracker.paused(self, queued, at)
+        self.events.send('paused', queued, self.state[2])
+
+class EnginePlayer(Player):
+    # The Player in the audio process, reading from a RingReader
+    def __init__(self, ring_path, doorbell, events, device, rate, *args):
+        self.ring_path = ring_path
+        self.doorbell = doorbell
+        Player.__init__(self, device, rate, *args)
+        self.position = ForwardedPosition(rate, events)
+
+    def create_ring(self, periodsize, buffer_length):
+        return RingReader(self.ring_path, periodsize * self.framesize, buffer_length,
+                self.framesize, self.doorbell)
+
+    def set_latency(self, periodsize, buffer_length, periods, ring_path):
+        self.ring_path = ring_path
+        Player.set_latency(self, periodsize, buffer_length, periods)
+
+    #As Player.buffer_flush, keeping what was written after the flush
+    def buffer_flush(self, head=None):
+        if self.playing():
+            self.pause()
+
+        self.ring.clear(head)
+        self.dsp_processed = 0
+        if self.device is not None:
+            self.device_drop()
+
+#Runs in the audio process: calls from the ProcessPlayer on the main thread,
+#playback and mixer on the Player's threads
+def serve(control, events, ring_path, doorbell, args, parent_ends):
+    #Ctrl-C is for the parent, this process ends when the parent goes away,
+    #which it only notices once it doesn't hold the parent's ends of the
+    #pipes itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for connection in parent_ends:
+        connection.close()
+    events = Events(events)
+    for name in ['underruns', 'xruns', 'write_duration']:
+        setattr(metrics, name, ForwardedMetric(events, name))
+
+    #The whole process belongs to the audio, the playback threads still set
+    #their own scheduling as they start
+    realtime.forward = lambda *args: events.send('realtime', *args)
+    if realtime.audio_cpus is not None:
+        realtime.set_affinity('audio_cpus', realtime.audio_cpus)
+    if realtime.mlock:
+        realtime.lock_memory()
+
+    player = EnginePlayer(ring_path, doorbell, events, *args)
+    control.send((None, 'ok', None))
+
+    while 1:
+        if control.poll(MIXER_POLL):
+            try:
+                call, name, call_args = control.recv()
+            except EOFError:
+                break
+            try:
+                reply = (call, 'ok', getattr(player, name)(*call_args))
+            except Exception as error:
+                reply = (call, 'error', PlayerError(str(error)))
+            #Calls without a number don't wait for an answer, errors are
+            #reported as events
+            if call is not None:
+                control.send(reply)
+            elif reply[1] == 'error':
+                events.send('error', name, str(reply[2]))
+
+        if player.mixer_loaded():
+            volume = player.mixer_changes()
+            if volume is not None:
+                events.send('volume', volume)
+
+    if player.acquired():
+        player.release()
+
+class ProcessPlayer:
+    # A Player running in its own process, so that nothing else happening
+    # in this one, like garbage collection or a busy web server, can hold up
+    # the writes to the device. Audio goes through a shared RingWriter, calls
+    # over a pipe, and what the audio process sees, from written frames to
+    # metrics and mixer changes, comes back over another one. State the
+    # libspotify callbacks and the pump check all the time is kept here
+    # rather than asked for.
+    def __init__(self, device, rate, channels, periodsize, buffer_length, periods=4, nonblock=False, mmap=False, output='alsa'):
+        self.device_name = device
+        self.rate = rate
+        self.framesize = channels * 2 # S16_LE
+        self.position = PositionTracker(rate)
+        self.dropped = 0
+
+        self.device_acquired = False
+        self.device_playing = False
+        self.device_queued = 0
+        self.stopped_at = None
+        self.mixer = False
+        self.mixer_external = None
+
+        self.call_lock = Lock()
+        self.calls = 0
+
+        self.doorbell = os.pipe()
+        flags = fcntl.fcntl(self.doorbell[1], fcntl.F_GETFL)
+        fcntl.fcntl(self.doorbell[1], fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.ring = RingWriter.create(periodsize * self.framesize, buffer_length,
+                self.framesize, self.doorbell[1])
+        #Writer head as of the last flush
+        self.flushed = 0
+
+        self.control, control = Pipe()
+        self.events, events = Pipe(duplex=False)
+        self.process = Process(target=serve, name='audio {}'.format(device),
+                args=(control, events, self.ring.path, self.doorbell,
+                      (device, rate, channels, periodsize, buffer_length, periods, nonblock, mmap, output),
+                      [self.control, self.events]))
+        self.process.daemon = True
+        self.process.start()
+        control.close()
+        events.close()
+        os.close(self.doorbell[0])
+
+        #The audio process has the ring mapped once it answers
+        self.reply(None)
+        os.unlink(self.ring.path)
+
+        self.events_t = Thread(target=self.events_thread)
+        self.events_t.daemon = True
+        self.events_t.start()
+
+    def reply(self, call):
+        while 1:
+            if not self.control.poll(CALL_TIMEOUT):
+                raise PlayerError("PlayerError: audio process not responding")
+            try:
+                reply, status, result = self.control.recv()
+            except EOFError:
+                raise PlayerError("PlayerError: audio process exited")
+            #Answers to calls that timed out earlier
+            if reply != call:
+                continue
+            if status == 'error':
+                raise result
+            return result
+
+    def call(self, name, *args):
+        with self.call_lock:
+            self.calls += 1
+            try:
+                self.control.send((self.calls, name, args))
+            except IOError:
+                raise PlayerError("PlayerError: audio process exited")
+            return self.reply(self.calls)
+
+    #For calls made from libspotify callbacks, which mustn't wait on the
+    #audio process
+    def send(self, name, *args):
+        with self.call_lock:
+            try:
+                self.control.send((None, name, args))
+            except IOError:
+                raise PlayerError("PlayerError: audio process exited")
+
+    def events_thread(self):
+        while 1:
+            try:
+                event = self.events.recv()
+            except EOFError:
+                print "PlayerError: audio process exited"
+                return
+
+            if event[0] == 'delivered':
+                self.device_queued = event[2]
+                self.position.delivered(event[1], event[2], event[3])
+            elif event[0] == 'dropped':
+                self.device_queued = 0
+                self.position.dropped(event[1])
+            elif event[0] == 'paused':
+                self.device_queued = event[1]
+                self.position.paused(event[1], event[2])
+            elif event[0] == 'metric':
+                getattr(getattr(metrics, event[1]), event[2])(event[3])
+            elif event[0] == 'volume':
+                self.mixer_external = event[1]
+            elif event[0] == 'realtime':
+                realtime.record(*event[1:])
+            elif event[0] == 'error':
+                print "{} ({})".format(event[2], event[1])
+
+    def mixer_load(self, mixer="", volmin=0, volmax=100):
+        self.call('mixer_load', mixer, volmin, volmax)
+        self.mixer = True
+
+    def mixer_changes(self):
+        volume, self.mixer_external = self.mixer_external, None
+        return volume
+
+    def mixer_loaded(self):
+        return self.mixer
+
+    def dsp_load(self, gain_db=0.0, limiter=False, mix='stereo'):
+        self.call('dsp_load', gain_db, limiter, mix)
+
+    def acquire(self):
+        self.call('acquire')
+        self.device_acquired = True
+        self.device_queued = 0
+        self.stopped_at = time.time()
+
+    def release(self):
+        self.call('release')
+        self.device_acquired = False
+        self.device_playing = False
+
+    def acquired(self):
+        return self.device_acquired
+
+    def hw_params(self):
+        return self.call('hw_params')
+
+    def set_latency(self, periodsize, buffer_length, periods):
+        ring = RingWriter.create(periodsize * self.framesize, buffer_length,
+                self.framesize, self.doorbell[1])
+        try:
+            self.call('set_latency', periodsize, buffer_length, periods, ring.path)
+        finally:
+            os.unlink(ring.path)
+        self.ring = ring
+        self.flushed = 0
+
+    def play(self):
+        self.call('play')
+        self.device_playing = True
+        self.stopped_at = None
+
+    def pause(self):
+        self.call('pause')
+        self.device_playing = False
+        self.stopped_at = time.time()
+
+    def idle_time(self):
+        if not self.device_acquired or self.stopped_at is None:
+            return 0
+        return time.time() - self.stopped_at
+
+    def playing(self):
+        return self.device_playing
+
+    def write(self, data):
+        return self.ring.write(data)
+
+    def buffer_flush(self):
+        self.send('buffer_flush', self.ring.head)
+        self.flushed = self.ring.head
+        if self.device_playing:
+            self.device_playing = False
+            self.stopped_at = time.time()
+
+    #Audio from before a flush doesn't count, though the audio process may
+    #not have thrown it away yet
+    def buffer_length(self):
+        return min(self.ring.length(), self.ring.head - self.flushed) / self.framesize
+
+    def device_delay(self):
+        if not self.device_acquired:
+            return 0
+        return self.device_queued
+
+    def buffer_capacity(self):
+        return self.ring.size / self.framesize
+
+    def health(self):
+        health = self.call('health')
+        health['dropped'] = self.dropped
+        return health
+
+    def outputs(self):
+        return [self.health()]
+
+    def volrange_set(self, volmin, volmax):
+        self.call('volrange_set', volmin, volmax)
+
+    def volume_get(self):
+        return self.call('volume_get')
+
+    def volume_set(self, volume):
+        self.send('volume_set', volume)
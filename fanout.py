@@ -0,0 +1,144 @@
+from player import PlayerError
+
+class FanOut:
+    # Plays one stream on several Players at once, with the same interface
+    # as a single Player. Every output has its own buffer, playback thread
+    # and mixer, so a slow device only falls behind itself: whatever its
+    # buffer can't take is dropped for that output alone rather than held
+    # back from the others.
+    #
+    # outputs is a list of (Player, delay) pairs. delay is the number of
+    # frames of silence put in front of the stream on that output, to line it
+    # up with outputs that have more latency.
+    def __init__(self, outputs):
+        self.players = [player for player, delay in outputs]
+        self.delays = [delay for player, delay in outputs]
+        #Silence still has to go in front of the stream
+        self.aligned = False
+
+        #The first output is the reference for position and pending samples
+        self.primary = self.players[0]
+        self.position = self.primary.position
+        self.framesize = self.primary.framesize
+
+    def mixer_load(self, mixer="", volmin=0, volmax=100):
+        errors = []
+        for player in self.players:
+            try:
+                player.mixer_load(mixer, volmin, volmax)
+            except PlayerError as error:
+                print "{}: {}".format(player.device_name, error)
+                errors.append(error)
+
+        if len(errors) == len(self.players):
+            raise errors[0]
+
+    #Volume (0-65535) last set by another program on any of the mixers
+    def mixer_changes(self):
+        changed = None
+        for player in self.players:
+            if player.mixer_loaded():
+                volume = player.mixer_changes()
+                if volume is not None:
+                    changed = volume
+        return changed
+
+    def mixer_loaded(self):
+        return any(player.mixer_loaded() for player in self.players)
+
+    def dsp_load(self, gain_db=0.0, limiter=False, mix='stereo'):
+        for player in self.players:
+            player.dsp_load(gain_db, limiter, mix)
+
+    def volume_get(self):
+        for player in self.players:
+            if player.mixer_loaded():
+                return player.volume_get()
+
+    def volume_set(self, volume):
+        for player in self.players:
+            player.volume_set(volume)
+
+    #Outputs that fail to open are skipped, as long as one of them works
+    def acquire(self):
+        errors = []
+        for player in self.players:
+            if player.acquired():
+                continue
+            try:
+                player.acquire()
+            except PlayerError as error:
+                print "{}: {}".format(player.device_name, error)
+                errors.append(error)
+
+        if not self.acquired():
+            raise errors[0]
+
+    def release(self):
+        for player in self.players:
+            if player.acquired():
+                player.release()
+
+    def acquired(self):
+        return any(player.acquired() for player in self.players)
+
+    def hw_params(self):
+        return self.primary.hw_params()
+
+    def set_latency(self, periodsize, buffer_length, periods):
+        for player in self.players:
+            player.set_latency(periodsize, buffer_length, periods)
+        self.aligned = False
+
+    def play(self):
+        for player in self.players:
+            if player.acquired() and not player.playing():
+                player.play()
+
+    def pause(self):
+        for player in self.players:
+            if player.playing():
+                player.pause()
+
+    #A device that failed to open mustn't keep the others from being released
+    def idle_time(self):
+        return min([player.idle_time() for player in self.players if player.acquired()] or [0])
+
+    def playing(self):
+        return any(player.playing() for player in self.players)
+
+    #Accepts as much as the output with the most room did. Outputs whose
+    #device failed to open are left out, like in play()
+    def write(self, data):
+        outputs = [(player, delay) for player, delay in zip(self.players, self.delays) if player.acquired()]
+        if not outputs:
+            return 0
+
+        if not self.aligned:
+            for player, delay in outputs:
+                if delay:
+                    player.write(bytearray(delay * self.framesize))
+            self.aligned = True
+
+        written = [player.write(data) for player, delay in outputs]
+        accepted = max(written)
+        for (player, delay), length in zip(outputs, written):
+            player.dropped += (accepted - length) / self.framesize
+        return accepted
+
+    def buffer_flush(self):
+        for player in self.players:
+            player.buffer_flush()
+        self.aligned = False
+
+    def buffer_length(self):
+        return self.primary.buffer_length()
+
+    def buffer_capacity(self):
+        return self.primary.buffer_capacity()
+
+    def device_delay(self):
+        return self.primary.device_delay()
+
+    def outputs(self):
+        return [player.health() for player in self.players]
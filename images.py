@@ -0,0 +1,108 @@
+import os
+import hashlib
+import urllib2
+from collections import OrderedDict
+from utils import LRUCache
+
+class ImageError(IOError):
+    pass
+
+def http_fetch(url):
+    try:
+        return urllib2.urlopen(url, timeout=10).read()
+    except ValueError as error:
+        #urllib2's answer to a url it can't parse
+        raise ImageError(error)
+
+class LocalFetcher:
+    #Stand-in for http_fetch that serves files from a directory, named after
+    #the last path component of the url. For running without network access.
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, url):
+        with open(os.path.join(self.directory, url.rstrip('/').rsplit('/', 1)[-1]), 'rb') as f:
+            return f.read()
+
+def content_type(data):
+    if data.startswith('\x89PNG'):
+        return 'image/png'
+    return 'image/jpeg'
+
+class ImageCache:
+    #resolve(uri, size) returns the url of an image, fetch(url) its bytes.
+    #Recently used images are kept in memory, up to disk_bytes of them on disk.
+    def __init__(self, directory, resolve, fetch=http_fetch, memory_items=32, disk_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.resolve = resolve
+        self.fetch = fetch
+        self.memory = LRUCache(memory_items)
+        self.disk_bytes = disk_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        #Oldest first, so eviction order survives restarts
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        entries = []
+        for name in os.listdir(directory):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self.disk[name] = size
+            self.disk_used += size
+
+    def get(self, uri, size):
+        key = hashlib.sha1('{}:{}'.format(uri, size)).hexdigest()
+
+        data = self.memory.get(key)
+        if data is None:
+            data = self.disk_read(key)
+            if data is None:
+                url = self.resolve(uri, size)
+                if not url:
+                    raise ImageError("no image url for {}".format(uri))
+                data = self.fetch(url)
+                self.disk_write(key, data)
+            self.memory.put(key, data)
+        return data
+
+    def disk_read(self, key):
+        size = self.disk.pop(key, None)
+        if size is None:
+            return None
+
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.disk_used -= size
+            return None
+
+        self.disk[key] = size
+        return data
+
+    def disk_write(self, key, data):
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as error:
+            print "ImageCache: {}".format(error)
+            return
+
+        #Two misses for the same image both end up here
+        self.disk_used += len(data) - self.disk.pop(key, 0)
+        self.disk[key] = len(data)
+
+        while self.disk_used > self.disk_bytes and len(self.disk) > 1:
+            name, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -1,13 +1,25 @@
 #First run the command avahi-publish-service TestConnect _spotify-connect._tcp 4000 VERSION=1.0 CPath=/login/_zeroconf
 #TODO: Add error checking
 import os
-from flask import Flask, request, abort, jsonify, render_template, redirect, flash, url_for
+import json
+import metrics
+import realtime
+from flask import Flask, request, abort, jsonify, render_template, redirect, flash, url_for, Response
 from flask_bootstrap import Bootstrap
 from gevent.wsgi import WSGIServer
-from gevent import spawn_later, sleep
+from gevent import spawn, sleep, get_hub
+from gevent.event import Event
+from gevent.queue import Queue, Empty
+from gevent import Timeout
 from connect_ffi import ffi, lib
+import console_callbacks
 from connect import Connect
-from utils import get_zeroconf_vars, get_metadata, get_image_url
+from console_callbacks import audio_player, set_latency, get_latency, notify_listeners
+from player import PlayerError
+from utils import get_zeroconf_vars, get_metadata, get_image_url, get_queue, Snapshot, IMAGE_SIZES
+from images import ImageCache, http_fetch, content_type
+from pump import Pump
+from commands import CommandQueue
 
 app = Flask(__name__)
 Bootstrap(app)
@@ -18,17 +30,44 @@ app.secret_key = os.urandom(24)
 #Used by the error callback to determine login status
 invalid_login = False
 
-@ffi.callback('void(SpError error, void *userdata)')
+#Push channel for /api/events
+EVENTS_KEEPALIVE = 15
+#Refresh even without a notification, in case libspotify changed something silently
+EVENTS_REFRESH = 5
+
+subscribers = set()
+#Last status and metadata sent to subscribers
+state = {}
+state_changed = Event()
+notify_listeners.append(state_changed.set)
+
+@ffi.callback('void(SpError, void *)')
 def web_error_callback(error, userdata):
     global invalid_login
     if error == lib.kSpErrorLoginBadCredentials:
         invalid_login = True
+        state_changed.set()
 
 connect_app = Connect(web_error_callback)
 
+#Control requests only queue their libspotify calls, the pump loop runs them
+commands = CommandQueue()
+#Seconds a control request waits for its command to run
+COMMAND_TIMEOUT = 2
+
 if os.environ.get('DEBUG') or connect_app.args.debug:
     app.debug = True
 
+#Downloads run on gevent's thread pool so they can't stall the pump greenlet
+def threaded_fetch(url):
+    return get_hub().threadpool.apply(http_fetch, (url,))
+
+images = ImageCache(connect_app.args.image_cache, get_image_url, threaded_fetch,
+        disk_bytes=connect_app.args.image_cache_size * 1024 * 1024)
+
+#Image uris always refer to the same image
+IMAGE_MAX_AGE = 30 * 24 * 60 * 60
+
 ##Routes
 
 #Home page
@@ -38,37 +77,56 @@ def index():
 
 ##API routes
 
+#Waits for a queued command to run, and turns its SpError into the response.
+#Commands that don't return an SpError return None
+def command_response(future):
+    try:
+        error = future.get(timeout=COMMAND_TIMEOUT)
+    except Timeout:
+        return jsonify({
+            'error': 'timed out waiting for libspotify'
+        }), 504
+    if error is not None and error != lib.kSpErrorOk:
+        return jsonify({
+            'error': 'libspotify error {}'.format(error)
+        }), 500
+    return '', 204
+
+#Skips queued before the pump runs add up, next and prev cancel out
+def skip(count):
+    error = lib.kSpErrorOk
+    for i in xrange(abs(count)):
+        error = lib.SpPlaybackSkipToNext() if count > 0 else lib.SpPlaybackSkipToPrev()
+    return error
+
+def add_skips(queued, added):
+    return (queued[0] + added[0],)
+
 #Playback routes
 @app.route('/api/playback/play')
 def playback_play():
-    lib.SpPlaybackPlay()
-    return '', 204
+    return command_response(commands.put('play', lib.SpPlaybackPlay))
 
 @app.route('/api/playback/pause')
 def playback_pause():
-    lib.SpPlaybackPause()
-    return '', 204
+    return command_response(commands.put('play', lib.SpPlaybackPause))
 
 @app.route('/api/playback/prev')
 def playback_prev():
-    lib.SpPlaybackSkipToPrev()
-    return '', 204
+    return command_response(commands.put('skip', skip, (-1,), add_skips))
 
 @app.route('/api/playback/next')
 def playback_next():
-    lib.SpPlaybackSkipToNext()
-    return '', 204
+    return command_response(commands.put('skip', skip, (1,), add_skips))
 
 #TODO: Add ability to disable shuffle/repeat
 @app.route('/api/playback/shuffle')
 def playback_shuffle():
-    lib.SpPlaybackEnableShuffle()
-    return '', 204
+    return command_response(commands.put('shuffle', lib.SpPlaybackEnableShuffle, (True,)))
 
 @app.route('/api/playback/repeat')
 def playback_repeat():
-    lib.SpPlaybackEnableRepeat()
-    return '', 204
+    return command_response(commands.put('repeat', lib.SpPlaybackEnableRepeat, (True,)))
 
 @app.route('/api/playback/volume', methods=['GET'])
 def playback_volume():
@@ -83,29 +141,147 @@ def playback_volume():
         return jsonify({
             'error': 'value must be set'
         }), 400
-    lib.SpPlaybackUpdateVolume(volume)
-    return '', 204
+    return command_response(commands.put('volume', lib.SpPlaybackUpdateVolume, (volume,)))
+
+#Audio routes
+@app.route('/api/audio/latency', methods=['GET'])
+def audio_latency():
+    return jsonify(get_latency())
+
+@app.route('/api/audio/latency', methods=['POST'], endpoint='audio_latency-post')
+def audio_latency():
+    try:
+        profile = request.form.get('profile', get_latency()['profile'])
+        period_time = request.form.get('period_time', type=int)
+        buffer_time = request.form.get('buffer_time', type=int)
+        set_latency(profile, period_time, buffer_time)
+    except ValueError as error:
+        return jsonify({
+            'error': str(error)
+        }), 400
+    except PlayerError as error:
+        return jsonify({
+            'error': str(error)
+        }), 500
+    return jsonify(get_latency())
+
+#Buffer health of each output device
+@app.route('/api/audio/outputs')
+def audio_outputs():
+    return jsonify({
+        'outputs': audio_player.outputs()
+    })
 
 #Info routes
-@app.route('/api/info/metadata')
-def info_metadata():
+def load_metadata():
     res = get_metadata()
     res['volume'] = lib.SpPlaybackGetVolume()
-    return jsonify(res)
+    return res
 
-@app.route('/api/info/status')
-def info_status():
-    return jsonify({
+#Only read from libspotify again after a track, login or volume notification,
+#or when broadcast_events refreshes it
+metadata_snapshot = Snapshot(load_metadata)
+
+def current_metadata():
+    return metadata_snapshot.get(console_callbacks.metadata_version)
+
+queue_snapshot = Snapshot(lambda: {'tracks': get_queue()})
+
+def current_queue():
+    return queue_snapshot.get(console_callbacks.metadata_version)
+
+#Serves the cached JSON body of a snapshot, or 304 if the client has it already
+def snapshot_response(snapshot):
+    response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    return response.make_conditional(request)
+
+def current_status():
+    return {
         'active': bool(lib.SpPlaybackIsActiveDevice()),
         'playing': bool(lib.SpPlaybackIsPlaying()),
         'shuffle': bool(lib.SpPlaybackIsShuffled()),
         'repeat': bool(lib.SpPlaybackIsRepeated()),
-        'logged_in': bool(lib.SpConnectionIsLoggedIn())
-    })
+        'logged_in': bool(lib.SpConnectionIsLoggedIn()),
+        'login_failed': invalid_login,
+        #Milliseconds, from the frames actually played by alsa
+        'position': audio_player.position.position(),
+        'drift': round(audio_player.position.drift(), 1),
+        'latency': audio_player.position.latency(),
+        #Scheduling, affinity and memory locking as applied, see --realtime
+        'realtime': realtime.status()
+    }
+
+@app.route('/api/info/metadata')
+def info_metadata():
+    current_metadata()
+    return snapshot_response(metadata_snapshot)
+
+#Previous, current and upcoming tracks, with their cover urls already resolved
+@app.route('/api/info/queue')
+def info_queue():
+    current_queue()
+    return snapshot_response(queue_snapshot)
+
+@app.route('/api/info/status')
+def info_status():
+    return jsonify(current_status())
+
+#Server-sent events carrying only the status and metadata fields that changed
+@app.route('/api/events')
+def info_events():
+    queue = Queue()
+    subscribers.add(queue)
+    #Catch up on anything that changed while nobody was listening
+    state_changed.set()
+
+    def stream():
+        try:
+            for kind, values in state.items():
+                yield 'event: {}\ndata: {}\n\n'.format(kind, json.dumps(values))
+            while 1:
+                try:
+                    kind, delta = queue.get(timeout=EVENTS_KEEPALIVE)
+                except Empty:
+                    yield ':\n\n'
+                    continue
+                yield 'event: {}\ndata: {}\n\n'.format(kind, json.dumps(delta))
+        finally:
+            subscribers.discard(queue)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/info/image_url/<image_uri>')
 def info_image_url(image_uri):
-    return redirect(get_image_url(str(image_uri)))
+    size = request.args.get('size', 'small')
+    if size not in IMAGE_SIZES:
+        return jsonify({
+            'error': 'size must be one of {}'.format(', '.join(sorted(IMAGE_SIZES)))
+        }), 400
+    return redirect(get_image_url(str(image_uri), IMAGE_SIZES[size]))
+
+@app.route('/api/info/image/<image_uri>')
+def info_image(image_uri):
+    size = request.args.get('size', 'small')
+    if size not in IMAGE_SIZES:
+        return jsonify({
+            'error': 'size must be one of {}'.format(', '.join(sorted(IMAGE_SIZES)))
+        }), 400
+
+    try:
+        data = images.get(str(image_uri), IMAGE_SIZES[size])
+    except (IOError, OSError) as error:
+        print "info_image: {}".format(error)
+        url = get_image_url(str(image_uri), IMAGE_SIZES[size])
+        if not url:
+            return jsonify({'error': 'no image for {}'.format(image_uri)}), 404
+        #Let the browser try fetching it itself
+        return redirect(url)
+
+    response = Response(data, mimetype=content_type(data))
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    return response
 
 @app.route('/api/info/display_name', methods=['GET'])
 def info_display_name():
@@ -120,19 +296,26 @@ def info_display_name():
         return jsonify({
             'error': 'displayName must be set'
         }), 400
-    lib.SpSetDisplayName(display_name)
-    return '', 204
+    return command_response(commands.put('display_name', lib.SpSetDisplayName, (display_name,)))
+
+#Metrics routes
+@app.route('/api/metrics')
+def api_metrics():
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify(metrics.json())
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
 
 #Login routes
 @app.route('/login/logout')
 def login_logout():
-    lib.SpConnectionLogout()
+    commands.put('login', lib.SpConnectionLogout)
     return redirect(url_for('index'))
 
 @app.route('/login/password', methods=['POST'])
 def login_password():
     global invalid_login
     invalid_login = False
+    state_changed.set()
     username = str(request.form.get('username'))
     password = str(request.form.get('password'))
 
@@ -140,7 +323,7 @@ def login_password():
         flash('Username or password not specified', 'danger')
     else:
         flash('Waiting for spotify', 'info')
-        connect_app.login(username, password=password)
+        commands.put('login', connect_app.login, (username, password))
         sleep
 
     return redirect(url_for('index'))
@@ -185,7 +368,7 @@ def get_info():
         'status': 101,
         'spotifyError': 0,
         'activeUser': zeroconf_vars['activeUser'],
-        'brandDisplayName': ffi.string(connect_app.init_vars['brandName']),
+        'brandDisplayName': ffi.string(connect_app.config['brandName']),
         'accountReq': zeroconf_vars['accountReq'],
         #Doesn't have any specific format (I think)
         'deviceID': zeroconf_vars['deviceId'],
@@ -195,7 +378,7 @@ def get_info():
         'version': '2.0.1',
         #Valid types are UNKNOWN, COMPUTER, TABLET, SMARTPHONE, SPEAKER, TV, AVR, STB and AUDIODONGLE
         'deviceType': zeroconf_vars['deviceType'],
-        'modelDisplayName': ffi.string(connect_app.init_vars['modelName']),
+        'modelDisplayName': ffi.string(connect_app.config['modelName']),
         #Status codes are ERROR-OK (not actually an error), ERROR-MISSING-ACTION, ERROR-INVALID-ACTION, ERROR-SPOTIFY-ERROR, ERROR-INVALID-ARGUMENTS, ERROR-UNKNOWN, and ERROR_LOG_FILE
         'statusString': 'ERROR-OK',
         #Name that shows up in the Spotify client
@@ -209,7 +392,7 @@ def add_user():
     blob = str(args.get('blob'))
     clientKey = str(args.get('clientKey'))
 
-    connect_app.login(username, zeroconf=(blob,clientKey))
+    commands.put('login', connect_app.login, (userName, None, None, (blob, clientKey)))
 
     return jsonify({
         'status': 101,
@@ -218,12 +401,50 @@ def add_user():
         })
 
 #Loop to pump events
-def pump_events():
-    lib.SpPumpEvents()
-    connect_app.check_events()
-    spawn_later(0.1, pump_events)
-
-pump_events()
+pump = Pump(connect_app, commands)
+pump_wakeup = Event()
+
+def pump_wait(timeout):
+    pump_wakeup.wait(timeout)
+    pump_wakeup.clear()
+
+#Queued commands run on the next pump, so don't wait for the idle interval to
+#run out
+def wakeup_pump():
+    pump.wakeup()
+    pump_wakeup.set()
+
+commands.wakeup = wakeup_pump
+
+spawn(pump.run, pump_wait)
+
+#Push status and metadata changes to /api/events subscribers
+def broadcast_events():
+    while 1:
+        if not state_changed.wait(EVENTS_REFRESH):
+            #Nothing was notified, check for what changes without notifying
+            metadata_snapshot.refresh()
+            queue_snapshot.refresh()
+        state_changed.clear()
+        #Prefetch upcoming tracks and covers as soon as the track changes,
+        #rather than on the first request for them
+        current_queue()
+        if not subscribers:
+            continue
+
+        current = {
+            'status': current_status(),
+            'metadata': current_metadata()
+        }
+        for kind, values in current.iteritems():
+            previous = state.setdefault(kind, {})
+            delta = { k: v for (k, v) in values.iteritems() if previous.get(k) != v }
+            if delta:
+                previous.update(delta)
+                for queue in subscribers:
+                    queue.put((kind, delta))
+
+spawn(broadcast_events)
 
 #Only run if script is run directly and not by an import
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import time
+from bisect import bisect_left
+
+#Updates happen from the libspotify callback and playback threads without any
+#locking. A lost increment under contention is acceptable, a lock in the audio
+#path is not.
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def prometheus(self):
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} counter'.format(self.name),
+                '{} {}'.format(self.name, self.value)]
+
+    def json(self):
+        return self.value
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def prometheus(self):
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} gauge'.format(self.name),
+                '{} {}'.format(self.name, self.value)]
+
+    def json(self):
+        return self.value
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        #One extra slot for +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self, start):
+        self.observe(time.time() - start)
+
+    def prometheus(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        total = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, total))
+        lines.append('{}_sum {}'.format(self.name, self.sum))
+        lines.append('{}_count {}'.format(self.name, self.count))
+        return lines
+
+    def json(self):
+        return {
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+            'sum': self.sum,
+            'count': self.count
+        }
+
+registry = []
+
+def counter(name, help):
+    metric = Counter(name, help)
+    registry.append(metric)
+    return metric
+
+def gauge(name, help):
+    metric = Gauge(name, help)
+    registry.append(metric)
+    return metric
+
+def histogram(name, help, buckets):
+    metric = Histogram(name, help, buckets)
+    registry.append(metric)
+    return metric
+
+def prometheus():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.prometheus())
+    return '\n'.join(lines) + '\n'
+
+def json():
+    return { metric.name: metric.json() for metric in registry }
+
+#Seconds
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+
+callback_duration = histogram('spotify_playback_data_seconds', 'Time spent in the playback_data callback', LATENCY_BUCKETS)
+samples_offered = counter('spotify_samples_offered_total', 'Samples offered by libspotify to playback_data')
+samples_accepted = counter('spotify_samples_accepted_total', 'Samples accepted into the audio buffer')
+buffer_full = counter('spotify_buffer_full_total', 'playback_data calls that could not accept every sample')
+buffer_frames = gauge('audio_buffer_frames', 'Frames currently held in the audio buffer')
+buffer_depth = histogram('audio_buffer_fill_ratio', 'Audio buffer fill level seen by playback_data', [0.1, 0.25, 0.5, 0.75, 0.9, 1.0])
+underruns = counter('audio_underruns_total', 'Times the ring buffer ran short of a period during playback, not counting filling up after play or a flush')
+xruns = counter('audio_alsa_xruns_total', 'ALSA underruns recovered from by the PCM device')
+write_duration = histogram('audio_alsa_write_seconds', 'Duration of each ALSA PCM write', LATENCY_BUCKETS)
+output_latency = gauge('audio_output_latency_seconds', 'Audio queued in the ALSA device after the last write')
+position_drift = gauge('audio_clock_drift_seconds', 'Device clock minus system clock since playback last started')
+pump_duration = histogram('spotify_pump_events_seconds', 'Duration of each SpPumpEvents call', LATENCY_BUCKETS)
+pump_lateness = histogram('spotify_pump_late_seconds', 'How much later than scheduled each SpPumpEvents call ran', LATENCY_BUCKETS)
+command_queue_depth = gauge('spotify_command_queue_depth', 'Control commands waiting for the pump loop')
+commands_coalesced = counter('spotify_commands_coalesced_total', 'Control commands merged into one already waiting')
+command_duration = histogram('spotify_command_seconds', 'Time from queueing a control command to it having run', LATENCY_BUCKETS)
@@ -1,21 +1,72 @@
-import alsaaudiovolmap as alsa
-import Queue
+#Only needed for the alsa output, the other sinks work without it
+try:
+    import alsaaudiovolmap as alsa
+except ImportError:
+    alsa = None
+import os
+import select
+import time
+import metrics
+import realtime
 from threading import Thread, Event
+from ringbuffer import RingBuffer
+from position import PositionTracker
+from sinks import open_sink, SinkError
+
+#Seconds to wait for more volume updates before writing to the mixer
+MIXER_DEBOUNCE = 0.03
 
 class Player:
-    def __init__(self, device, rate, channels, periodsize, buffer_length):    
+    def __init__(self, device, rate, channels, periodsize, buffer_length, periods=4, nonblock=False, mmap=False, output='alsa'):
         self.device = None
         self.device_name = device
+        #'alsa', or one of the sinks.SINKS, which device_name is then passed to
+        self.output = output
+        #Write from a poll loop on a PCM_NONBLOCK device instead of blocking
+        #in write() once per period
+        self.nonblock = nonblock
+        #Copy audio straight into the mmapped device buffer from write(), the
+        #device buffer then takes the place of the ring buffer and there's no
+        #playback thread
+        self.mmap = mmap
+        self.mmap_playing = False
+        #Frames queued in the hardware, as of the last write
+        self.device_queued = 0
+        self.position = PositionTracker(rate)
         self.rate = rate
         self.channels = channels
         self.periodsize = periodsize
+        self.periods = periods
+        self.buffer_periods = buffer_length
+        #Paused in hardware, rather than stopped
+        self.device_paused = False
+        #When playback last stopped, for releasing the device once idle
+        self.stopped_at = None
         
         self.mixer = None
+        #Optional dsp.DSP applied to each period before it is written
+        self.dsp = None
+        #Ring position up to which the dsp has been applied, a partial
+        #write leaves processed data behind
+        self.dsp_processed = 0
+        #Frames thrown away by a FanOut because this player's buffer was full
+        self.dropped = 0
     
-        self.queue = Queue.Queue(maxsize=buffer_length)
+        self.framesize = channels * 2 # S16_LE
+        self.ring = self.create_ring(periodsize, buffer_length)
         self.t = Thread()
+
+    #Buffer between write() and the playback thread, replaced by
+    #engine.EnginePlayer with one shared with another process
+    def create_ring(self, periodsize, buffer_length):
+        return RingBuffer(periodsize * self.framesize, buffer_length, self.framesize)
         
     def mixer_load(self, mixer="", volmin=0, volmax=100):
+        if self.output != 'alsa':
+            raise PlayerError("PlayerError: {} output has no mixer".format(self.output))
+        if alsa is None:
+            raise PlayerError("PlayerError: pyalsaaudio is not installed")
+
         if not mixer:
             try:
                 device_mixers = alsa.mixers(device=self.device_name)
@@ -27,18 +78,81 @@ class Player:
             else:
                 raise PlayerError("PlayerError: Device has no mixers")
         
+        #Volumes are 16 bit (0-65535) like libspotify's, mapped to hardware
+        #values through a table the mixer precomputes once
         try:
             self.mixer = alsa.Mixer(mixer, device=self.device_name)
+            self.mixer.setvolumetable(volmin, volmax)
+            self.mixer_volume = self.mixer.getvolume16()
         except alsa.ALSAAudioError as error:
             raise PlayerError("PlayerError: {}".format(error))
             
         self.volmin = volmin
         self.volmax = volmax
+
+        #Volume writes and external changes are handled by mixer_thread, so
+        #the libspotify callbacks never wait on the mixer
+        self.mixer_pending = None
+        self.mixer_external = None
+        self.mixer_stop = False
+        self.mixer_wakeup = os.pipe()
+        self.mixer_t = Thread(target=self.mixer_thread)
+        self.mixer_t.daemon = True
+        self.mixer_t.start()
             
     def mixer_unload(self):
+        self.mixer_stop = True
+        os.write(self.mixer_wakeup[1], 'x')
+        self.mixer_t.join()
+        for fd in self.mixer_wakeup:
+            os.close(fd)
+
         self.mixer.close()
         self.mixer = None
+
+    def mixer_thread(self):
+        poller = select.poll()
+        poller.register(self.mixer_wakeup[0], select.POLLIN)
+        for fd, events in self.mixer.polldescriptors():
+            poller.register(fd, events)
+
+        while not self.mixer_stop:
+            ready = [fd for fd, event in poller.poll()]
+            try:
+                if self.mixer_wakeup[0] in ready:
+                    #Let a burst of updates settle and only write the last one
+                    time.sleep(MIXER_DEBOUNCE)
+                    os.read(self.mixer_wakeup[0], 4096)
+                    pending, self.mixer_pending = self.mixer_pending, None
+                    if pending is not None:
+                        self.mixer.setvolume16(pending)
+                        #Cache what the hardware actually rounded it to, so
+                        #the change event for our own write isn't mistaken
+                        #for an external one
+                        self.mixer.handleevents()
+                        self.mixer_volume = self.mixer.getvolume16()
+
+                if len(ready) > 1 or self.mixer_wakeup[0] not in ready:
+                    self.mixer.handleevents()
+                    mixer_volume = self.mixer.getvolume16()
+                    if mixer_volume != self.mixer_volume:
+                        self.mixer_volume = mixer_volume
+                        self.mixer_external = mixer_volume
+            except alsa.ALSAAudioError as error:
+                print "PlayerError: {}".format(error)
+
+    #Volume (0-65535) last set by another program, if it changed since the last call
+    def mixer_changes(self):
+        volume, self.mixer_external = self.mixer_external, None
+        return volume
                 
+    #Software volume is needed without a mixer, the rest only if asked for
+    def dsp_load(self, gain_db=0.0, limiter=False, mix='stereo'):
+        if self.mixer is None or gain_db or limiter or mix != 'stereo':
+            #Only imported when needed, numpy takes a while to load
+            from dsp import DSP
+            self.dsp = DSP(self.channels, gain_db, limiter, mix)
+
     def mixer_loaded(self):
         if self.mixer is not None:
             return True
@@ -46,16 +160,42 @@ class Player:
             return False
             
     def acquire(self):
+        if self.output != 'alsa':
+            try:
+                self.device = open_sink(self.output, self.device_name, self.rate,
+                        self.channels, self.periodsize, self.periods)
+            except SinkError as error:
+                raise PlayerError(error)
+            self.device_paused = False
+            self.device_queued = 0
+            self.stopped_at = time.time()
+            return
+
+        if alsa is None:
+            raise PlayerError("PlayerError: pyalsaaudio is not installed")
+
         try:
-            self.device = alsa.PCM(alsa.PCM_PLAYBACK, device=self.device_name)
+            mode = alsa.PCM_NONBLOCK if self.nonblock else alsa.PCM_NORMAL
+            self.device = alsa.PCM(alsa.PCM_PLAYBACK, mode, device=self.device_name)
             self.device.setchannels(self.channels)
             self.device.setrate(self.rate)
             self.device.setperiodsize(self.periodsize)
+            if self.mmap:
+                self.device.setperiods(self.buffer_periods)
+            else:
+                self.device.setperiods(self.periods)
             self.device.setformat(alsa.PCM_FORMAT_S16_LE)
+            if self.mmap:
+                self.device.setaccess(alsa.PCM_ACCESS_MMAP_INTERLEAVED)
         except alsa.ALSAAudioError as error:
             raise PlayerError("PlayerError: {}".format(error))
+        self.device_paused = False
+        self.device_queued = 0
+        self.stopped_at = time.time()
             
     def release(self):
+        #Don't wait for close() to drain whatever is left in the hardware buffer
+        self.device_drop()
         self.device.close()
         self.device = None
             
@@ -65,71 +205,295 @@ class Player:
         else:
             return False
 
-    def playback_thread(self, q, e):
+    #Hardware parameters negotiated with alsa, None if the device isn't open
+    def hw_params(self):
+        if self.device is not None:
+            return self.device.info()
+        else:
+            return None
+
+    #Takes effect immediately, anything already buffered is dropped
+    def set_latency(self, periodsize, buffer_length, periods):
+        playing = self.playing()
+        acquired = self.acquired()
+
+        self.buffer_flush()
+        if acquired:
+            self.release()
+
+        self.periodsize = periodsize
+        self.periods = periods
+        self.buffer_periods = buffer_length
+        self.ring = self.create_ring(periodsize, buffer_length)
+
+        if acquired:
+            self.acquire()
+            if playing:
+                self.play()
+
+    def playback_thread(self, ring, e):
+        realtime.apply_audio()
+        xruns = self.device.xruns()
+        #Filling up after play or a flush isn't an underrun, running dry
+        #after audio went out is, once until audio goes out again
+        starved = True
         while not e.is_set():
-            data = q.get()
-            if data:
-                self.device.write(data)
-            q.task_done()
+            if ring.length() < ring.periodsize and not starved:
+                metrics.underruns.inc()
+                starved = True
+
+            #Everything buffered up to half the hardware buffer goes out in
+            #one call, so a write still can't block for long
+            views = ring.read(e, max(self.periods / 2, 1))
+            if views is not None:
+                #A short write leaves processed data at the tail, which is
+                #read again and mustn't be processed twice
+                if self.dsp is not None:
+                    offset = ring.offset()
+                    position = ring.tail
+                    for view in views:
+                        skip = min(max(self.dsp_processed - position, 0), len(view))
+                        if skip < len(view):
+                            self.dsp.process(ring.data, offset + skip, len(view) - skip)
+                        position += len(view)
+                        offset = 0
+                    self.dsp_processed = max(self.dsp_processed, position)
+                start = time.time()
+                written = self.device.writev(views)
+                metrics.write_duration.time(start)
+                ring.consume(written * self.framesize)
+                self.device_queued = self.device.delay()
+                self.position.delivered(written, self.device_queued)
+                if written:
+                    starved = False
+
+                if self.device.xruns() != xruns:
+                    metrics.xruns.inc(self.device.xruns() - xruns)
+                    xruns = self.device.xruns()
+
+    #Waits for the device with poll() and hands it everything it has room
+    #for, so one write may cover several periods
+    def playback_poll_thread(self, ring, e):
+        poller = select.poll()
+        for fd, events in self.device.polldescriptors():
+            poller.register(fd, events)
+        timeout = 1000 * self.periodsize / self.rate
+        realtime.apply_audio()
+
+        xruns = self.device.xruns()
+        #Counted like in playback_thread
+        starved = True
+        while not e.is_set():
+            if ring.length() < ring.periodsize and not starved:
+                metrics.underruns.inc()
+                starved = True
+
+            if not ring.wait(e):
+                break
+
+            try:
+                avail = self.device.avail()
+                if avail < self.periodsize:
+                    poller.poll(timeout)
+                    continue
+
+                data = ring.peek(avail * self.framesize)
+                end = ring.tail + len(data)
+                if self.dsp is not None and end > self.dsp_processed:
+                    skip = max(self.dsp_processed - ring.tail, 0)
+                    self.dsp.process(ring.data, ring.offset() + skip, len(data) - skip)
+                    self.dsp_processed = end
+
+                start = time.time()
+                written = self.device.write(data)
+                metrics.write_duration.time(start)
+                ring.consume(written * self.framesize)
+                self.device_queued = self.device.delay()
+                self.position.delivered(written, self.device_queued)
+                if written:
+                    starved = False
+            except alsa.ALSAAudioError as error:
+                print "PlayerError: {}".format(error)
+                poller.poll(timeout)
+
+            if self.device.xruns() != xruns:
+                metrics.xruns.inc(self.device.xruns() - xruns)
+                xruns = self.device.xruns()
 
     def play(self):
+        if self.device_paused:
+            try:
+                self.device.pause(0)
+            except alsa.ALSAAudioError:
+                self.device_drop()
+            self.device_paused = False
+        self.stopped_at = None
+
+        if self.mmap:
+            self.mmap_playing = True
+            return
+
         self.t_stop = Event()
-        self.t = Thread(args=(self.queue, self.t_stop), target=self.playback_thread)
+        target = self.playback_poll_thread if self.nonblock else self.playback_thread
+        self.t = Thread(args=(self.ring, self.t_stop), target=target)
         self.t.daemon = True
         self.t.start()
     
+    #Stops writing but keeps the device open, anything still buffered is
+    #played once play() is called again
     def pause(self):
-        self.t_stop.set()
-        
-        if self.queue.empty():
-            self.queue.put(str())
-            
-        self.t.join()
+        if self.mmap:
+            self.mmap_playing = False
+        else:
+            self.t_stop.set()
+            self.ring.wakeup()
+            self.t.join()
+        self.stopped_at = time.time()
+
+        #Not every device can pause in hardware
+        try:
+            self.device.pause(1)
+            self.device_paused = True
+            self.device_queued = self.device.delay()
+            self.position.paused(self.device_queued)
+        except alsa.ALSAAudioError:
+            self.device_drop()
+
+    #Discards whatever is in the hardware buffer, leaving the device open and
+    #ready for the next write
+    def device_drop(self):
+        try:
+            self.device.drop()
+        except alsa.ALSAAudioError as error:
+            print "PlayerError: {}".format(error)
+        self.device_paused = False
+        self.position.dropped(self.device_queued)
+        self.device_queued = 0
+
+    #Seconds since the device was last used, 0 while playing or released
+    def idle_time(self):
+        if self.device is None or self.stopped_at is None:
+            return 0
+        return time.time() - self.stopped_at
         
     def playing(self):
+        if self.mmap:
+            return self.mmap_playing
         if self.t.isAlive():
             return True
         else:
             return False
             
-    def write(self, data):            
+    #Returns the number of bytes accepted, always a whole number of frames
+    def write(self, data):
+        if self.mmap:
+            return self.mmap_write(data)
+        return self.ring.write(data)
+
+    #Nothing is accepted until play() is called, like with the ring buffer
+    #the audio would otherwise start before libspotify says to play
+    def mmap_write(self, data):
+        if not self.mmap_playing:
+            return 0
+
+        src = memoryview(data)
+        length = len(src) - len(src) % self.framesize
+        written = 0
+        xruns = self.device.xruns()
+        start = time.time()
         try:
-            self.queue.put(data, block=False)
-        except Queue.Full:
-            raise BufferFull()
+            while written < length:
+                view = self.device.mmap_begin((length - written) / self.framesize)
+                if len(view) == 0:
+                    break
+                if self.dsp is not None:
+                    #The dsp needs a bytearray, so this costs one extra copy
+                    chunk = bytearray(src[written:written + len(view)])
+                    self.dsp.process(chunk, 0, len(chunk))
+                    view[:] = chunk
+                else:
+                    view[:] = src[written:written + len(view)]
+                committed = self.device.mmap_commit(len(view) / self.framesize)
+                if committed == 0:
+                    break
+                written += committed * self.framesize
+            self.device_queued = self.device.delay()
+        except alsa.ALSAAudioError as error:
+            print "PlayerError: {}".format(error)
+        metrics.write_duration.time(start)
+
+        if written:
+            self.position.delivered(written / self.framesize, self.device_queued)
+        if self.device.xruns() != xruns:
+            metrics.xruns.inc(self.device.xruns() - xruns)
+        return written
             
     def buffer_flush(self):
         if self.playing():
             self.pause()
     
-        while not self.queue.empty():
-            self.queue.get()
-            self.queue.task_done()
+        self.ring.clear()
+        self.dsp_processed = 0
+        if self.device is not None:
+            self.device_drop()
                 
+    #Number of buffered frames
     def buffer_length(self):
-        return self.queue.qsize()
+        return self.ring.length() / self.framesize
+
+    #Frames written to the device but not played yet, 0 if it isn't open
+    def device_delay(self):
+        if self.device is None:
+            return 0
+        return self.device_queued
+
+    #Size of the buffer in frames
+    def buffer_capacity(self):
+        return self.ring.size / self.framesize
+
+    #Buffer health, as reported for each output by /api/audio/outputs
+    def health(self):
+        return {
+            'device': self.device_name,
+            'acquired': self.acquired(),
+            'playing': self.playing(),
+            'buffered': self.buffer_length(),
+            'capacity': self.buffer_capacity(),
+            'latency': self.position.latency(),
+            'dropped': self.dropped,
+            'xruns': self.device.xruns() if self.device is not None else 0,
+            'mixer': self.mixer_loaded(),
+            'softvol': self.dsp is not None,
+        }
+
+    def outputs(self):
+        return [self.health()]
             
     def volrange_set(self, volmin, volmax):
+        try:
+            self.mixer.setvolumetable(volmin, volmax)
+        except alsa.ALSAAudioError as error:
+            raise PlayerError("PlayerError: {}".format(error))
         self.volmin = volmin
         self.volmax = volmax
     
+    #Volume (0-65535) as last read back from the mixer
     def volume_get(self):
-        mixer_volume = self.mixer.getvolume()[0]
-    
-        if mixer_volume > self.volmax:
-            mixer_volume = self.volmax
-        elif mixer_volume < self.volmin:
-            mixer_volume = self.volmin
-
-        volume = int(round((mixer_volume - self.volmin) / float(self.volmax - self.volmin) * 100))
-        return volume
+        return self.mixer_volume
         
+    #Returns immediately, the mixer is written from mixer_thread. Without a
+    #mixer the volume is applied by the dsp, if there is one.
     def volume_set(self, volume):
-        mixer_volume = int(round((self.volmax - self.volmin) * volume / 100.0 + self.volmin))
-        self.mixer.setvolume(mixer_volume)
+        if self.mixer is None:
+            if self.dsp is not None:
+                self.dsp.set_volume(volume / 65535.0)
+            return
+
+        if volume == self.mixer_volume and self.mixer_pending is None:
+            return
+
+        self.mixer_pending = volume
+        os.write(self.mixer_wakeup[1], 'x')
         
 class PlayerError(Exception):
-    pass
-
-class BufferFull(Exception):
     pass
\ No newline at end of file
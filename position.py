@@ -0,0 +1,73 @@
+import time
+import metrics
+
+class PositionTracker:
+    # Playback position from the frames actually written to the device,
+    # minus what snd_pcm_delay says is still queued in front of the speaker.
+    # Updated by the playback thread, read from anywhere, so the state is
+    # replaced as a whole tuple rather than field by field.
+    def __init__(self, rate):
+        self.rate = rate
+        #(frames written, frames queued, time of the last write, playing)
+        self.state = (0, 0, None, False)
+        self.reset(0)
+
+    #Position (ms) the next frame written belongs to, on seek or track change
+    def reset(self, millis):
+        #Whatever is still queued belongs to the old position
+        frames, queued, at, playing = self.state
+        self.base = millis
+        self.state = (queued, queued, at, playing)
+        #Reference point for drift, (time, played frames) of the first write
+        self.reference = None
+
+    #Called after each write with the frames written and snd_pcm_delay, at
+    #is when it happened if that wasn't just now
+    def delivered(self, frames, queued, at=None):
+        if at is None:
+            at = time.time()
+        total = self.state[0] + frames
+        self.state = (total, queued, at, True)
+        if self.reference is None:
+            self.reference = (at, total - queued)
+
+        metrics.output_latency.set(queued / float(self.rate))
+        metrics.position_drift.set(self.drift() / 1000.0)
+
+    #Frames queued in the device were discarded, or playback stopped
+    def dropped(self, queued):
+        frames, _, at, _ = self.state
+        self.state = (frames - queued, 0, at, False)
+        self.reference = None
+
+    #Paused in hardware with queued frames still to be played on resume
+    def paused(self, queued, at=None):
+        frames = self.state[0]
+        self.state = (frames, queued, at if at is not None else time.time(), False)
+        self.reference = None
+
+    #Frames heard so far, the queue drains in real time while playing
+    def played(self):
+        frames, queued, at, playing = self.state
+        if playing and at is not None:
+            queued = max(queued - (time.time() - at) * self.rate, 0)
+        return frames - queued
+
+    def position(self):
+        return self.base + int(self.played() * 1000 / self.rate)
+
+    #How far the device clock has moved away from the system clock (ms)
+    #since playback last started, positive if the device runs fast
+    def drift(self):
+        reference = self.reference
+        if reference is None:
+            return 0.0
+        at, played = reference
+        frames, queued, last, _ = self.state
+        device = (frames - queued - played) * 1000.0 / self.rate
+        system = (last - at) * 1000.0
+        return device - system
+
+    #Output latency (ms), how long until the next frame written is heard
+    def latency(self):
+        return int(self.state[1] * 1000 / self.rate)
@@ -0,0 +1,67 @@
+import time
+import metrics
+from connect_ffi import lib
+from console_callbacks import audio_player, play_event, pause_event
+
+#Seconds between SpPumpEvents calls
+PLAYING_INTERVAL = 0.02
+IDLE_INTERVAL = 0.1
+MAX_IDLE_INTERVAL = 0.5
+MAX_LOGGED_OUT_INTERVAL = 2.0
+
+class Pump:
+    #commands is an optional CommandQueue, drained before every pump
+    def __init__(self, connect, commands=None):
+        self.connect = connect
+        self.commands = commands
+        self.idle_interval = IDLE_INTERVAL
+        self.state = None
+
+    #Pumps events once and returns how long to wait before the next call
+    def run_once(self):
+        if self.commands is not None:
+            self.commands.run()
+
+        start = time.time()
+        lib.SpPumpEvents()
+        metrics.pump_duration.time(start)
+
+        if play_event.is_set() or pause_event.is_set():
+            self.connect.check_events()
+        elif audio_player.acquired() and not audio_player.playing():
+            self.connect.check_idle()
+
+        #Volume changed by another program, e.g. alsamixer
+        if audio_player.mixer_loaded():
+            volume = audio_player.mixer_changes()
+            if volume is not None:
+                lib.SpPlaybackUpdateVolume(volume)
+
+        if audio_player.playing() or lib.SpPlaybackIsPlaying():
+            self.idle_interval = IDLE_INTERVAL
+            return PLAYING_INTERVAL
+
+        #Back off while nothing changes, start over as soon as something does
+        state = (bool(lib.SpConnectionIsLoggedIn()), bool(lib.SpPlaybackIsActiveDevice()))
+        if state != self.state:
+            self.state = state
+            self.idle_interval = IDLE_INTERVAL
+        else:
+            max_interval = MAX_IDLE_INTERVAL if state[0] else MAX_LOGGED_OUT_INTERVAL
+            self.idle_interval = min(self.idle_interval * 2, max_interval)
+
+        return self.idle_interval
+
+    #Something outside of libspotify happened, stop backing off
+    def wakeup(self):
+        self.state = None
+
+    #wait is called with the delay until the next pump, e.g. time.sleep
+    def run(self, wait):
+        while 1:
+            interval = self.run_once()
+            due = time.time() + interval
+            wait(interval)
+            #Woken up early by wakeup counts as on time, anything keeping the
+            #loop busy past the interval shows up here
+            metrics.pump_lateness.observe(max(time.time() - due, 0))
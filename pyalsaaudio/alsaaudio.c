@@ -47,7 +47,17 @@ typedef struct {
     int rate;
     int format;
     snd_pcm_uframes_t periodsize;
+    unsigned int periods;
+    snd_pcm_uframes_t buffersize;
     int framesize;
+    snd_pcm_access_t access;
+
+    // Region of the device buffer handed out by mmap_begin()
+    snd_pcm_uframes_t mmap_offset;
+    snd_pcm_uframes_t mmap_frames;
+
+    // Number of underruns recovered from in write()
+    unsigned long xruns;
 
 } alsapcm_t;
 
@@ -70,6 +80,9 @@ typedef struct {
     long pmax;
     long cmin;
     long cmax;
+
+    /* 16 bit playback volume lookup table, see setvolumetable() */
+    struct volume_table ptable;
     snd_mixer_t *handle;
 } alsamixer_t;
 
@@ -230,6 +243,7 @@ static int alsapcm_setup(alsapcm_t *self)
     int res,dir;
     unsigned int val;
     snd_pcm_format_t fmt;
+    snd_pcm_access_t access;
     snd_pcm_uframes_t frames;
     snd_pcm_hw_params_t *hwparams;
 
@@ -246,8 +260,7 @@ static int alsapcm_setup(alsapcm_t *self)
        back out.
      */
     snd_pcm_hw_params_any(self->handle, hwparams);
-    snd_pcm_hw_params_set_access(self->handle, hwparams,
-                                 SND_PCM_ACCESS_RW_INTERLEAVED);
+    snd_pcm_hw_params_set_access(self->handle, hwparams, self->access);
     snd_pcm_hw_params_set_format(self->handle, hwparams, self->format);
     snd_pcm_hw_params_set_channels(self->handle, hwparams,
                                    self->channels);
@@ -256,7 +269,8 @@ static int alsapcm_setup(alsapcm_t *self)
     snd_pcm_hw_params_set_rate(self->handle, hwparams, self->rate, dir);
     snd_pcm_hw_params_set_period_size(self->handle, hwparams,
                                       self->periodsize, dir);
-    snd_pcm_hw_params_set_periods(self->handle, hwparams, 4, 0);
+    snd_pcm_hw_params_set_periods_near(self->handle, hwparams,
+                                       &self->periods, &dir);
 
     /* Write it to the device */
     res = snd_pcm_hw_params(self->handle, hwparams);
@@ -265,11 +279,15 @@ static int alsapcm_setup(alsapcm_t *self)
        which should therefore be sync'ed with actual values */
     snd_pcm_hw_params_current(self->handle, hwparams);
 
+    snd_pcm_hw_params_get_access(hwparams, &access); self->access = access;
     snd_pcm_hw_params_get_format(hwparams, &fmt); self->format = fmt;
     snd_pcm_hw_params_get_channels(hwparams, &val); self->channels = val;
     snd_pcm_hw_params_get_rate(hwparams, &val, &dir); self->rate = val;
     snd_pcm_hw_params_get_period_size(hwparams, &frames, &dir);
     self->periodsize = (int) frames;
+    snd_pcm_hw_params_get_periods(hwparams, &val, &dir); self->periods = val;
+    snd_pcm_hw_params_get_buffer_size(hwparams, &frames);
+    self->buffersize = frames;
 
     self->framesize = self->channels * snd_pcm_hw_params_get_sbits(hwparams)/8;
 
@@ -340,6 +358,11 @@ alsapcm_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
     self->rate = 44100;
     self->format = SND_PCM_FORMAT_S16_LE;
     self->periodsize = 32;
+    self->periods = 4;
+    self->access = SND_PCM_ACCESS_RW_INTERLEAVED;
+    self->mmap_offset = 0;
+    self->mmap_frames = 0;
+    self->xruns = 0;
 
     res = snd_pcm_open(&(self->handle), device, self->pcmtype,
                        self->pcmmode);
@@ -689,6 +712,117 @@ exactly this number of frames, and each read will return this number of\n\
 frames (unless the device is in PCM_NONBLOCK mode, in which case it\n\
 may return nothing at all).");
 
+static PyObject *
+alsapcm_setperiods(alsapcm_t *self, PyObject *args)
+{
+    int periods;
+    int res;
+
+    if (!PyArg_ParseTuple(args,"i:setperiods", &periods))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    self->periods = periods;
+    res = alsapcm_setup(self);
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+
+        return NULL;
+    }
+    return PyLong_FromLong(self->periods);
+}
+
+PyDoc_STRVAR(setperiods_doc,
+"setperiods(periods) -> int\n\
+\n\
+Sets the number of periods in the hardware buffer to the nearest value\n\
+the device supports, and returns that value. The hardware buffer holds\n\
+periods * periodsize frames.");
+
+static PyObject *
+alsapcm_setaccess(alsapcm_t *self, PyObject *args)
+{
+    int access;
+    int res;
+
+    if (!PyArg_ParseTuple(args,"i:setaccess", &access))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    if (access != SND_PCM_ACCESS_RW_INTERLEAVED &&
+        access != SND_PCM_ACCESS_MMAP_INTERLEAVED)
+    {
+        PyErr_SetString(ALSAAudioError, "Unsupported access type");
+        return NULL;
+    }
+
+    self->access = access;
+    res = alsapcm_setup(self);
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+
+        return NULL;
+    }
+
+    if (self->access != access)
+    {
+        PyErr_Format(ALSAAudioError, "Access type not supported [%s]",
+                     self->cardname);
+
+        return NULL;
+    }
+    return PyLong_FromLong(self->access);
+}
+
+PyDoc_STRVAR(setaccess_doc,
+"setaccess(access) -> int\n\
+\n\
+Sets how the device buffer is accessed, PCM_ACCESS_RW_INTERLEAVED (the\n\
+default, for read() and write()) or PCM_ACCESS_MMAP_INTERLEAVED (for\n\
+mmap_begin() and mmap_commit()). Fails if the device doesn't support it.");
+
+static PyObject *
+alsapcm_info(alsapcm_t *self, PyObject *args)
+{
+    if (!PyArg_ParseTuple(args,":info"))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    return Py_BuildValue("{s:i,s:i,s:i,s:k,s:I,s:k,s:i}",
+                         "channels", self->channels,
+                         "rate", self->rate,
+                         "format", self->format,
+                         "periodsize", (unsigned long)self->periodsize,
+                         "periods", self->periods,
+                         "buffersize", (unsigned long)self->buffersize,
+                         "access", self->access);
+}
+
+PyDoc_STRVAR(info_doc,
+"info() -> dict\n\
+\n\
+Returns the hardware parameters negotiated with the device: channels,\n\
+rate, format, periodsize, periods and buffersize (in frames).");
+
 static PyObject *
 alsapcm_read(alsapcm_t *self, PyObject *args)
 {
@@ -760,48 +894,74 @@ In PCM_NONBLOCK mode, the call will not block, but will return (0,'')\n\
 if no new period has become available since the last call to read.");
 
 
+/* Writes frames with underrun recovery, called with the GIL released */
+static snd_pcm_sframes_t
+alsapcm_writei(alsapcm_t *self, const char *data, snd_pcm_uframes_t frames)
+{
+    snd_pcm_sframes_t res;
+
+    res = snd_pcm_writei(self->handle, data, frames);
+    if (res == -EPIPE)
+    {
+        /* EPIPE means underrun */
+        self->xruns++;
+        res = snd_pcm_recover(self->handle, res, 1);
+        if (res >= 0)
+            res = snd_pcm_writei(self->handle, data, frames);
+    }
+    return res;
+}
+
+/* Like the s* format, also accepts objects that only have the old buffer
+   interface (such as buffer()) in Python 2.x */
+static int
+alsapcm_getbuffer(PyObject *obj, Py_buffer *view)
+{
+#if PY_MAJOR_VERSION < 3
+    const void *ptr;
+    Py_ssize_t len;
+
+    if (!PyObject_CheckBuffer(obj))
+    {
+        if (PyObject_AsReadBuffer(obj, &ptr, &len) < 0)
+            return -1;
+        return PyBuffer_FillInfo(view, obj, (void *)ptr, len, 1, PyBUF_SIMPLE);
+    }
+#endif
+    return PyObject_GetBuffer(obj, view, PyBUF_SIMPLE);
+}
+
 static PyObject *alsapcm_write(alsapcm_t *self, PyObject *args)
 {
-    int res;
-    int datalen;
-    char *data;
+    snd_pcm_sframes_t res;
+    Py_buffer buf;
     PyObject *rc = NULL;
 
 #if PY_MAJOR_VERSION < 3
-    if (!PyArg_ParseTuple(args,"s#:write", &data, &datalen))
+    if (!PyArg_ParseTuple(args,"s*:write", &buf))
         return NULL;
 #else
-    Py_buffer buf;
-
     if (!PyArg_ParseTuple(args,"y*:write", &buf))
         return NULL;
-
-    data = buf.buf;
-    datalen = buf.len;
 #endif
 
     if (!self->handle)
     {
         PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        PyBuffer_Release(&buf);
         return NULL;
     }
 
-    if (datalen % self->framesize)
+    if (buf.len % self->framesize)
     {
         PyErr_SetString(ALSAAudioError,
                         "Data size must be a multiple of framesize");
+        PyBuffer_Release(&buf);
         return NULL;
     }
 
     Py_BEGIN_ALLOW_THREADS
-    res = snd_pcm_writei(self->handle, data, datalen/self->framesize);
-    if (res == -EPIPE)
-    {
-        /* EPIPE means underrun */
-        res = snd_pcm_recover(self->handle, res, 1);
-        if (res >= 0)
-            res = snd_pcm_writei(self->handle, data, datalen/self->framesize);
-    }
+    res = alsapcm_writei(self, buf.buf, buf.len / self->framesize);
     Py_END_ALLOW_THREADS
 
     if (res == -EAGAIN) {
@@ -816,9 +976,7 @@ static PyObject *alsapcm_write(alsapcm_t *self, PyObject *args)
         rc = PyLong_FromLong(res);
     }
 
-#if PY_MAJOR_VERSION >= 3
     PyBuffer_Release(&buf);
-#endif
 
     return rc;
 }
@@ -826,8 +984,10 @@ static PyObject *alsapcm_write(alsapcm_t *self, PyObject *args)
 PyDoc_STRVAR(write_doc,
 "write(data) -> bytes written\n\
 \n\
-Writes (plays) the sound in data. The length of data must be a multiple\n\
-of the frame size, and should be exactly the size of a period. If less\n\
+Writes (plays) the sound in data, which can be any object supporting the\n\
+buffer interface (str, bytearray, memoryview, ...) and is not copied.\n\
+The length of data must be a multiple of the frame size, and should be\n\
+exactly the size of a period. If less\n\
 than 'period size' frames are provided, the actual playout will not\n\
 happen until more data is written.\n\
 If the device is not in PCM_NONBLOCK mode, this call will block if the\n\
@@ -840,6 +1000,380 @@ value of zero, if the buffer is full. In this case, the data should be\n\
 written at a later time.");
 
 
+static PyObject *alsapcm_writev(alsapcm_t *self, PyObject *args)
+{
+    PyObject *bufsobj;
+    PyObject *seq;
+    Py_buffer *bufs;
+    Py_ssize_t count, i;
+    Py_ssize_t acquired = 0;
+    const char *data;
+    snd_pcm_uframes_t frames = 0;
+    snd_pcm_sframes_t res = 0;
+    long total = 0;
+    PyObject *rc = NULL;
+
+    if (!PyArg_ParseTuple(args,"O:writev", &bufsobj))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    seq = PySequence_Fast(bufsobj, "writev() argument must be a sequence");
+    if (!seq)
+        return NULL;
+
+    count = PySequence_Fast_GET_SIZE(seq);
+    bufs = PyMem_New(Py_buffer, count ? count : 1);
+    if (!bufs)
+    {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+
+    for (acquired = 0; acquired < count; acquired++)
+    {
+        if (alsapcm_getbuffer(PySequence_Fast_GET_ITEM(seq, acquired),
+                              &bufs[acquired]) < 0)
+            goto out;
+
+        if (bufs[acquired].len % self->framesize)
+        {
+            PyErr_SetString(ALSAAudioError,
+                            "Data size must be a multiple of framesize");
+            acquired++;
+            goto out;
+        }
+    }
+
+    /* One pass over all the buffers without taking the GIL back */
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < count; i++)
+    {
+        data = bufs[i].buf;
+        frames = bufs[i].len / self->framesize;
+        while (frames > 0)
+        {
+            res = alsapcm_writei(self, data, frames);
+            if (res < 0)
+                break;
+            total += res;
+            data += res * self->framesize;
+            frames -= res;
+        }
+        if (frames > 0)
+            break;
+    }
+    Py_END_ALLOW_THREADS
+
+    /* Whatever was written before an error still counts */
+    if (res < 0 && res != -EAGAIN && total == 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+    }
+    else {
+        rc = PyLong_FromLong(total);
+    }
+
+out:
+    for (i = 0; i < acquired; i++)
+        PyBuffer_Release(&bufs[i]);
+    PyMem_Free(bufs);
+    Py_DECREF(seq);
+
+    return rc;
+}
+
+PyDoc_STRVAR(writev_doc,
+"writev(buffers) -> frames written\n\
+\n\
+Writes the sound in a sequence of buffers (str, bytearray, memoryview or\n\
+anything else supporting the buffer interface) in one call, with the\n\
+interpreter lock released until all of them are written. Each buffer's\n\
+length must be a multiple of the frame size. This allows several periods,\n\
+or both halves of a wrapped ring buffer region, to be written without a\n\
+Python call per period.\n\
+\n\
+In PCM_NONBLOCK mode, the call returns as soon as the device is full,\n\
+with the number of frames that were written.");
+
+
+static PyObject *
+alsapcm_mmap_begin(alsapcm_t *self, PyObject *args)
+{
+    const snd_pcm_channel_area_t *areas;
+    snd_pcm_uframes_t offset;
+    snd_pcm_uframes_t frames;
+    snd_pcm_sframes_t res;
+    long requested;
+    char *addr;
+    Py_buffer view;
+
+    if (!PyArg_ParseTuple(args,"l:mmap_begin", &requested))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    if (self->access != SND_PCM_ACCESS_MMAP_INTERLEAVED)
+    {
+        PyErr_Format(ALSAAudioError, "Not in PCM_ACCESS_MMAP_INTERLEAVED "
+                     "mode [%s]", self->cardname);
+        return NULL;
+    }
+
+    if (requested < 0)
+    {
+        PyErr_SetString(ALSAAudioError, "Frame count must not be negative");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    /* mmap_begin() only sees the hardware pointer as of the last update */
+    res = snd_pcm_avail_update(self->handle);
+    if (res == -EPIPE)
+    {
+        self->xruns++;
+        res = snd_pcm_recover(self->handle, res, 1);
+        if (res >= 0)
+            res = snd_pcm_avail_update(self->handle);
+    }
+    if (res >= 0)
+    {
+        frames = (snd_pcm_uframes_t)requested < (snd_pcm_uframes_t)res ?
+            (snd_pcm_uframes_t)requested : (snd_pcm_uframes_t)res;
+        res = snd_pcm_mmap_begin(self->handle, &areas, &offset, &frames);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+
+    self->mmap_offset = offset;
+    self->mmap_frames = frames;
+
+    /* Interleaved, so all channels share the first area */
+    addr = (char *)areas[0].addr + (areas[0].first + offset * areas[0].step) / 8;
+    if (PyBuffer_FillInfo(&view, NULL, addr, frames * self->framesize, 0,
+                          PyBUF_CONTIG) < 0)
+        return NULL;
+
+    return PyMemoryView_FromBuffer(&view);
+}
+
+PyDoc_STRVAR(mmap_begin_doc,
+"mmap_begin(frames) -> memoryview\n\
+\n\
+Returns a writable memoryview straight into the device buffer, for up to\n\
+frames frames. It can be shorter than requested when less space is free,\n\
+or the free space wraps around the end of the buffer. Write the sound\n\
+into it, then call mmap_commit() with the number of frames written. The\n\
+view must not be used after mmap_commit() or close().\n\
+\n\
+Requires PCM_ACCESS_MMAP_INTERLEAVED, see setaccess().");
+
+
+static PyObject *
+alsapcm_mmap_commit(alsapcm_t *self, PyObject *args)
+{
+    long frames;
+    snd_pcm_sframes_t res;
+
+    if (!PyArg_ParseTuple(args,"l:mmap_commit", &frames))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    if (frames < 0 || (snd_pcm_uframes_t)frames > self->mmap_frames)
+    {
+        PyErr_SetString(ALSAAudioError,
+                        "Can't commit more frames than mmap_begin() returned");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    res = snd_pcm_mmap_commit(self->handle, self->mmap_offset, frames);
+    /* Unlike write(), committing doesn't start the stream by itself */
+    if (res > 0 && snd_pcm_state(self->handle) == SND_PCM_STATE_PREPARED)
+    {
+        int started = snd_pcm_start(self->handle);
+        if (started < 0)
+            res = started;
+    }
+    if (res == -EPIPE)
+    {
+        self->xruns++;
+        res = snd_pcm_recover(self->handle, res, 1);
+    }
+    Py_END_ALLOW_THREADS
+
+    self->mmap_frames = 0;
+
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+    return PyLong_FromLong(res);
+}
+
+PyDoc_STRVAR(mmap_commit_doc,
+"mmap_commit(frames) -> frames committed\n\
+\n\
+Hands frames frames written into the view returned by mmap_begin() to the\n\
+device, starting playback if it isn't running yet. Returns 0 if the\n\
+device had underrun in the meantime, in which case the frames are lost\n\
+and the device is ready for the next mmap_begin().");
+
+
+static PyObject *alsapcm_drop(alsapcm_t *self, PyObject *args)
+{
+    int res;
+
+    if (!PyArg_ParseTuple(args,":drop"))
+        return NULL;
+
+    if (!self->handle) {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    res = snd_pcm_drop(self->handle);
+    if (res >= 0)
+        res = snd_pcm_prepare(self->handle);
+    Py_END_ALLOW_THREADS
+
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+
+        return NULL;
+    }
+    return PyLong_FromLong(res);
+}
+
+PyDoc_STRVAR(drop_doc,
+"drop()\n\
+\n\
+Stops the PCM device immediately, discarding any frames still in the\n\
+hardware buffer, and prepares it for the next write. Unlike closing and\n\
+reopening the device, this keeps the hardware parameters.");
+
+static PyObject *
+alsapcm_avail(alsapcm_t *self, PyObject *args)
+{
+    snd_pcm_sframes_t res;
+
+    if (!PyArg_ParseTuple(args,":avail"))
+        return NULL;
+
+    if (!self->handle) {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    res = snd_pcm_avail(self->handle);
+    if (res == -EPIPE)
+    {
+        /* Underrun, the whole buffer is free again once recovered */
+        self->xruns++;
+        res = snd_pcm_recover(self->handle, res, 1);
+        if (res >= 0)
+            res = snd_pcm_avail(self->handle);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+    return PyLong_FromLong(res);
+}
+
+PyDoc_STRVAR(avail_doc,
+"avail() -> int\n\
+\n\
+Returns the number of frames that can be written (or read) without\n\
+blocking. Underruns are recovered from like in write().");
+
+
+static PyObject *
+alsapcm_delay(alsapcm_t *self, PyObject *args)
+{
+    snd_pcm_sframes_t delay = 0;
+    int res;
+
+    if (!PyArg_ParseTuple(args,":delay"))
+        return NULL;
+
+    if (!self->handle) {
+        PyErr_SetString(ALSAAudioError, "PCM device is closed");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    res = snd_pcm_delay(self->handle, &delay);
+    Py_END_ALLOW_THREADS
+
+    if (res == -EPIPE)
+    {
+        /* Nothing left to play after an underrun */
+        delay = 0;
+    }
+    else if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+    return PyLong_FromLong(delay);
+}
+
+PyDoc_STRVAR(delay_doc,
+"delay() -> int\n\
+\n\
+Returns the number of frames between the next write() and the moment\n\
+its first frame is heard, i.e. what is still queued in the hardware\n\
+buffer plus the device's own latency.");
+
+
+static PyObject *
+alsapcm_xruns(alsapcm_t *self, PyObject *args)
+{
+    if (!PyArg_ParseTuple(args,":xruns"))
+        return NULL;
+
+    return PyLong_FromUnsignedLong(self->xruns);
+}
+
+PyDoc_STRVAR(xruns_doc,
+"xruns() -> int\n\
+\n\
+Returns the number of underruns write() has recovered from since the\n\
+PCM device was opened.");
+
+
 static PyObject *alsapcm_pause(alsapcm_t *self, PyObject *args)
 {
     int enabled=1, res;
@@ -941,13 +1475,27 @@ static PyMethodDef alsapcm_methods[] = {
     {"setformat", (PyCFunction)alsapcm_setformat, METH_VARARGS, setformat_doc},
     {"setperiodsize", (PyCFunction)alsapcm_setperiodsize, METH_VARARGS,
      setperiodsize_doc},
+    {"setperiods", (PyCFunction)alsapcm_setperiods, METH_VARARGS,
+     setperiods_doc},
+    {"info", (PyCFunction)alsapcm_info, METH_VARARGS, info_doc},
     {"dumpinfo", (PyCFunction)alsapcm_dumpinfo, METH_VARARGS},
     {"read", (PyCFunction)alsapcm_read, METH_VARARGS, read_doc},
     {"write", (PyCFunction)alsapcm_write, METH_VARARGS, write_doc},
+    {"writev", (PyCFunction)alsapcm_writev, METH_VARARGS, writev_doc},
+    {"setaccess", (PyCFunction)alsapcm_setaccess, METH_VARARGS,
+     setaccess_doc},
+    {"mmap_begin", (PyCFunction)alsapcm_mmap_begin, METH_VARARGS,
+     mmap_begin_doc},
+    {"mmap_commit", (PyCFunction)alsapcm_mmap_commit, METH_VARARGS,
+     mmap_commit_doc},
     {"pause", (PyCFunction)alsapcm_pause, METH_VARARGS, pause_doc},
+    {"drop", (PyCFunction)alsapcm_drop, METH_VARARGS, drop_doc},
+    {"xruns", (PyCFunction)alsapcm_xruns, METH_VARARGS, xruns_doc},
     {"close", (PyCFunction)alsapcm_close, METH_VARARGS, pcm_close_doc},
     {"polldescriptors", (PyCFunction)alsapcm_polldescriptors, METH_VARARGS,
      pcm_polldescriptors_doc},
+    {"avail", (PyCFunction)alsapcm_avail, METH_VARARGS, avail_doc},
+    {"delay", (PyCFunction)alsapcm_delay, METH_VARARGS, delay_doc},
     {NULL, NULL}
 };
 
@@ -1147,6 +1695,7 @@ alsamixer_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
         return NULL;
 
     self->handle = 0;
+    memset(&self->ptable, 0, sizeof(self->ptable));
 
     err = alsamixer_gethandle(device, &self->handle);
     if (err < 0)
@@ -1258,6 +1807,7 @@ static void alsamixer_dealloc(alsamixer_t *self)
         free(self->controlname);
         self->handle = 0;
     }
+    volume_table_free(&self->ptable);
     PyObject_Del(self);
 }
 
@@ -1271,6 +1821,7 @@ alsamixer_close(alsamixer_t *self, PyObject *args)
     free(self->cardname);
     free(self->controlname);
     self->handle = 0;
+    volume_table_free(&self->ptable);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -1905,6 +2456,166 @@ The default is 'playback' if the mixer has this capability, otherwise\n\
 'capture'.");
 
 
+static PyObject *
+alsamixer_setvolumetable(alsamixer_t *self, PyObject *args)
+{
+    snd_mixer_elem_t *elem;
+    int volmin = 0;
+    int volmax = 100;
+    int res;
+
+    if (!PyArg_ParseTuple(args,"|ii:setvolumetable", &volmin, &volmax))
+        return NULL;
+
+    if (volmin < 0 || volmax > 100 || volmin >= volmax)
+    {
+        PyErr_SetString(ALSAAudioError,
+                        "Volume range must be ascending and within 0 and 100");
+        return NULL;
+    }
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "Mixer is closed");
+        return NULL;
+    }
+
+    if (!self->pchannels)
+    {
+        PyErr_Format(ALSAAudioError, "Mixer has no playback volume [%s]",
+                     self->cardname);
+        return NULL;
+    }
+
+    elem = alsamixer_find_elem(self->handle,self->controlname,self->controlid);
+
+    res = volume_table_init(&self->ptable, elem, volmin / 100.0, volmax / 100.0);
+
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+
+    return PyLong_FromLong(self->ptable.entries);
+}
+
+PyDoc_STRVAR(setvolumetable_doc,
+"setvolumetable([volmin, volmax]) -> int\n\
+\n\
+Precomputes the mapping between 16 bit volumes (0-65535) and the playback\n\
+volume of this mixer, as used by setvolume16() and getvolume16(). The\n\
+optional volmin and volmax arguments are percentages that limit the part\n\
+of the mixer's range the 16 bit volume is spread over. Returns the number\n\
+of distinct hardware volume steps in the table.");
+
+
+static PyObject *
+alsamixer_getvolume16(alsamixer_t *self, PyObject *args)
+{
+    snd_mixer_elem_t *elem;
+    int channel;
+    unsigned int volume;
+    int res;
+
+    if (!PyArg_ParseTuple(args,":getvolume16"))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "Mixer is closed");
+        return NULL;
+    }
+
+    if (!self->ptable.entries)
+    {
+        PyErr_SetString(ALSAAudioError,
+                        "No volume table, call setvolumetable() first");
+        return NULL;
+    }
+
+    elem = alsamixer_find_elem(self->handle,self->controlname,self->controlid);
+
+    for (channel = 0; channel <= SND_MIXER_SCHN_LAST; channel++) {
+        if (snd_mixer_selem_has_playback_channel(elem, channel))
+            break;
+    }
+
+    res = volume_table_get(&self->ptable, elem, channel, &volume);
+    if (res < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                     self->cardname);
+        return NULL;
+    }
+
+    return PyLong_FromLong(volume);
+}
+
+PyDoc_STRVAR(getvolume16_doc,
+"getvolume16() -> int\n\
+\n\
+Returns the playback volume of the first channel as a 16 bit volume\n\
+(0-65535), looked up in the table built by setvolumetable().");
+
+
+static PyObject *
+alsamixer_setvolume16(alsamixer_t *self, PyObject *args)
+{
+    snd_mixer_elem_t *elem;
+    int channel;
+    long volume;
+    int res;
+
+    if (!PyArg_ParseTuple(args,"l:setvolume16", &volume))
+        return NULL;
+
+    if (volume < 0 || volume >= VOLUME_TABLE_SIZE)
+    {
+        PyErr_SetString(ALSAAudioError, "Volume must be between 0 and 65535");
+        return NULL;
+    }
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "Mixer is closed");
+        return NULL;
+    }
+
+    if (!self->ptable.entries)
+    {
+        PyErr_SetString(ALSAAudioError,
+                        "No volume table, call setvolumetable() first");
+        return NULL;
+    }
+
+    elem = alsamixer_find_elem(self->handle,self->controlname,self->controlid);
+
+    for (channel = 0; channel <= SND_MIXER_SCHN_LAST; channel++) {
+        if (snd_mixer_selem_has_playback_channel(elem, channel)) {
+            res = volume_table_set(&self->ptable, elem, channel, volume);
+            if (res < 0)
+            {
+                PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(res),
+                             self->cardname);
+                return NULL;
+            }
+        }
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(setvolume16_doc,
+"setvolume16(volume)\n\
+\n\
+Sets the playback volume of all channels from a 16 bit volume (0-65535)\n\
+using the table built by setvolumetable(). No floating point math or\n\
+range queries are done per call.");
+
+
 static PyObject *
 alsamixer_setmute(alsamixer_t *self, PyObject *args)
 {
@@ -2078,6 +2789,42 @@ PyDoc_STRVAR(polldescriptors_doc,
 Return a list of file descriptors and event masks\n\
 suitable for use with poll to monitor changes on this mixer.");
 
+static PyObject *
+alsamixer_handleevents(alsamixer_t *self, PyObject *args)
+{
+    int handled;
+
+    if (!PyArg_ParseTuple(args,":handleevents"))
+        return NULL;
+
+    if (!self->handle)
+    {
+        PyErr_SetString(ALSAAudioError, "Mixer is closed");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    handled = snd_mixer_handle_events(self->handle);
+    Py_END_ALLOW_THREADS
+
+    if (handled < 0)
+    {
+        PyErr_Format(ALSAAudioError, "%s [%s]", snd_strerror(handled),
+                     self->cardname);
+        return NULL;
+    }
+
+    return PyLong_FromLong(handled);
+}
+
+PyDoc_STRVAR(handleevents_doc,
+"handleevents() -> int\n\
+\n\
+Processes pending mixer events, so that the values returned by getvolume()\n\
+and friends reflect changes made by other programs. Call it when one of\n\
+the descriptors from polldescriptors() becomes readable. Returns the\n\
+number of events handled.");
+
 static PyMethodDef alsamixer_methods[] = {
     {"cardname", (PyCFunction)alsamixer_cardname, METH_VARARGS,
      mixer_cardname_doc},
@@ -2096,10 +2843,18 @@ static PyMethodDef alsamixer_methods[] = {
     {"getrec", (PyCFunction)alsamixer_getrec, METH_VARARGS, getrec_doc},
     {"setvolume", (PyCFunction)alsamixer_setvolume, METH_VARARGS,
      setvolume_doc},
+    {"setvolumetable", (PyCFunction)alsamixer_setvolumetable, METH_VARARGS,
+     setvolumetable_doc},
+    {"getvolume16", (PyCFunction)alsamixer_getvolume16, METH_VARARGS,
+     getvolume16_doc},
+    {"setvolume16", (PyCFunction)alsamixer_setvolume16, METH_VARARGS,
+     setvolume16_doc},
     {"setmute", (PyCFunction)alsamixer_setmute, METH_VARARGS, setmute_doc},
     {"setrec", (PyCFunction)alsamixer_setrec, METH_VARARGS, setrec_doc},
     {"polldescriptors", (PyCFunction)alsamixer_polldescriptors, METH_VARARGS,
      polldescriptors_doc},
+    {"handleevents", (PyCFunction)alsamixer_handleevents, METH_VARARGS,
+     handleevents_doc},
 
     {NULL, NULL}
 };
@@ -2246,6 +3001,9 @@ PyObject *PyInit_alsaaudiovolmap(void)
     _EXPORT_INT(m, "PCM_NONBLOCK",SND_PCM_NONBLOCK);
     _EXPORT_INT(m, "PCM_ASYNC",SND_PCM_ASYNC);
 
+    _EXPORT_INT(m, "PCM_ACCESS_RW_INTERLEAVED",SND_PCM_ACCESS_RW_INTERLEAVED);
+    _EXPORT_INT(m, "PCM_ACCESS_MMAP_INTERLEAVED",SND_PCM_ACCESS_MMAP_INTERLEAVED);
+
     /* PCM Formats */
     _EXPORT_INT(m, "PCM_FORMAT_S8",SND_PCM_FORMAT_S8);
     _EXPORT_INT(m, "PCM_FORMAT_U8",SND_PCM_FORMAT_U8);
@@ -32,8 +32,10 @@
 
 #define _ISOC99_SOURCE /* lrint() */
 #define _GNU_SOURCE /* exp10() */
+#include <errno.h>
 #include <math.h>
 #include <stdbool.h>
+#include <stdlib.h>
 #include "volume_mapping.h"
 
 #ifdef __UCLIBC__
@@ -122,37 +124,63 @@ static double get_normalized_volume(snd_mixer_elem_t *elem,
 	return normalized;
 }
 
-static int set_normalized_volume(snd_mixer_elem_t *elem,
-				 snd_mixer_selem_channel_id_t channel,
-				 double volume,
-				 int dir,
-				 enum ctl_dir ctl_dir)
+struct volume_range {
+	long min, max;
+	bool dB;
+};
+
+static int get_volume_range(snd_mixer_elem_t *elem, enum ctl_dir ctl_dir,
+			    struct volume_range *range)
 {
-	long min, max, value;
-	double min_norm;
 	int err;
 
-	err = get_dB_range[ctl_dir](elem, &min, &max);
-	if (err < 0 || min >= max) {
-		err = get_raw_range[ctl_dir](elem, &min, &max);
-		if (err < 0)
-			return err;
-
-		value = lrint_dir(volume * (max - min), dir) + min;
-		return set_raw[ctl_dir](elem, channel, value);
+	err = get_dB_range[ctl_dir](elem, &range->min, &range->max);
+	if (err >= 0 && range->min < range->max) {
+		range->dB = true;
+		return 0;
 	}
 
-	if (use_linear_dB_scale(min, max)) {
-		value = lrint_dir(volume * (max - min), dir) + min;
-		return set_dB[ctl_dir](elem, channel, value, dir);
-	}
+	range->dB = false;
+	return get_raw_range[ctl_dir](elem, &range->min, &range->max);
+}
+
+/* Returns the raw register value, or the dB value (in 1/100 dB) if range->dB */
+static long normalized_to_value(const struct volume_range *range,
+				double volume, int dir)
+{
+	long min = range->min, max = range->max;
+	double min_norm;
+
+	if (!range->dB || use_linear_dB_scale(min, max))
+		return lrint_dir(volume * (max - min), dir) + min;
 
 	if (min != SND_CTL_TLV_DB_GAIN_MUTE) {
 		min_norm = exp10((min - max) / 6000.0);
 		volume = volume * (1 - min_norm) + min_norm;
 	}
-	value = lrint_dir(6000.0 * log10(volume), dir) + max;
-	return set_dB[ctl_dir](elem, channel, value, dir);
+	if (volume <= 0)
+		return min;
+	return lrint_dir(6000.0 * log10(volume), dir) + max;
+}
+
+static int set_normalized_volume(snd_mixer_elem_t *elem,
+				 snd_mixer_selem_channel_id_t channel,
+				 double volume,
+				 int dir,
+				 enum ctl_dir ctl_dir)
+{
+	struct volume_range range;
+	long value;
+	int err;
+
+	err = get_volume_range(elem, ctl_dir, &range);
+	if (err < 0)
+		return err;
+
+	value = normalized_to_value(&range, volume, dir);
+	if (range.dB)
+		return set_dB[ctl_dir](elem, channel, value, dir);
+	return set_raw[ctl_dir](elem, channel, value);
 }
 
 double get_normalized_playback_volume(snd_mixer_elem_t *elem,
@@ -182,3 +210,107 @@ int set_normalized_capture_volume(snd_mixer_elem_t *elem,
 {
 	return set_normalized_volume(elem, channel, volume, dir, CAPTURE);
 }
+
+/*
+ * The volume table maps the 16 bit volume range (0..65535) onto the distinct
+ * hardware values of a playback control once, so that getting and setting the
+ * volume afterwards needs no floating point math or range queries.  volmin
+ * and volmax (0..1) limit the part of the control's range that is used.
+ *
+ * values[] holds the distinct hardware values in ascending order and
+ * volumes[i] the lowest 16 bit volume that maps to values[i], so setting the
+ * volume read back from the control always selects the same hardware value.
+ */
+
+int volume_table_init(struct volume_table *table, snd_mixer_elem_t *elem,
+		      double volmin, double volmax)
+{
+	struct volume_range range;
+	long value;
+	unsigned int volume;
+	int err;
+
+	volume_table_free(table);
+
+	err = get_volume_range(elem, PLAYBACK, &range);
+	if (err < 0)
+		return err;
+
+	table->values = malloc(VOLUME_TABLE_SIZE * sizeof(*table->values));
+	table->volumes = malloc(VOLUME_TABLE_SIZE * sizeof(*table->volumes));
+	if (!table->values || !table->volumes) {
+		volume_table_free(table);
+		return -ENOMEM;
+	}
+
+	table->dB = range.dB;
+	for (volume = 0; volume < VOLUME_TABLE_SIZE; volume++) {
+		value = normalized_to_value(&range,
+			volmin + (volmax - volmin) * volume / (VOLUME_TABLE_SIZE - 1), 0);
+		if (table->entries == 0 || value != table->values[table->entries - 1]) {
+			table->values[table->entries] = value;
+			table->volumes[table->entries] = volume;
+			table->entries++;
+		}
+	}
+
+	/* Usually far fewer distinct values than volumes */
+	table->values = realloc(table->values, table->entries * sizeof(*table->values));
+	table->volumes = realloc(table->volumes, table->entries * sizeof(*table->volumes));
+	return 0;
+}
+
+void volume_table_free(struct volume_table *table)
+{
+	free(table->values);
+	free(table->volumes);
+	table->values = NULL;
+	table->volumes = NULL;
+	table->entries = 0;
+}
+
+int volume_table_set(const struct volume_table *table, snd_mixer_elem_t *elem,
+		     snd_mixer_selem_channel_id_t channel, unsigned int volume)
+{
+	int lo = 0, hi = table->entries - 1, mid;
+
+	/* Last entry whose lowest volume is <= volume */
+	while (lo < hi) {
+		mid = (lo + hi + 1) / 2;
+		if (table->volumes[mid] <= volume)
+			lo = mid;
+		else
+			hi = mid - 1;
+	}
+
+	if (table->dB)
+		return set_dB[PLAYBACK](elem, channel, table->values[lo], 0);
+	return set_raw[PLAYBACK](elem, channel, table->values[lo]);
+}
+
+int volume_table_get(const struct volume_table *table, snd_mixer_elem_t *elem,
+		     snd_mixer_selem_channel_id_t channel, unsigned int *volume)
+{
+	int lo = 0, hi = table->entries - 1, mid;
+	long value;
+	int err;
+
+	if (table->dB)
+		err = get_dB[PLAYBACK](elem, channel, &value);
+	else
+		err = get_raw[PLAYBACK](elem, channel, &value);
+	if (err < 0)
+		return err;
+
+	/* Last hardware value <= value, values outside volmin..volmax clamp */
+	while (lo < hi) {
+		mid = (lo + hi + 1) / 2;
+		if (table->values[mid] <= value)
+			lo = mid;
+		else
+			hi = mid - 1;
+	}
+
+	*volume = table->volumes[lo];
+	return 0;
+}
@@ -1,6 +1,7 @@
 #ifndef VOLUME_MAPPING_H_INCLUDED
 #define VOLUME_MAPPING_H_INCLUDED
 
+#include <stdbool.h>
 #include <alsa/asoundlib.h>
 
 double get_normalized_playback_volume(snd_mixer_elem_t *elem,
@@ -16,4 +17,21 @@ int set_normalized_capture_volume(snd_mixer_elem_t *elem,
 				  double volume,
 				  int dir);
 
+#define VOLUME_TABLE_SIZE 65536
+
+struct volume_table {
+	bool dB;
+	int entries;
+	long *values;
+	unsigned short *volumes;
+};
+
+int volume_table_init(struct volume_table *table, snd_mixer_elem_t *elem,
+		      double volmin, double volmax);
+void volume_table_free(struct volume_table *table);
+int volume_table_set(const struct volume_table *table, snd_mixer_elem_t *elem,
+		     snd_mixer_selem_channel_id_t channel, unsigned int volume);
+int volume_table_get(const struct volume_table *table, snd_mixer_elem_t *elem,
+		     snd_mixer_selem_channel_id_t channel, unsigned int *volume);
+
 #endif
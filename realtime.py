@@ -0,0 +1,157 @@
+import ctypes
+import os
+
+#Real-time scheduling, CPU affinity and memory locking for the playback path.
+#All of it is opt-in and best effort: without the permissions (CAP_SYS_NICE,
+#or rtprio and memlock limits in /etc/security/limits.conf) playback carries
+#on as before and the error is reported alongside what did take effect.
+
+#linux/sched.h and sys/mman.h
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+SCHED_RR = 2
+POLICIES = {'other': SCHED_OTHER, 'fifo': SCHED_FIFO, 'rr': SCHED_RR}
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+#Bits in a cpu_set_t
+CPU_SETSIZE = 1024
+
+class sched_param(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+CPUSet = ctypes.c_ulong * (CPU_SETSIZE / (8 * ctypes.sizeof(ctypes.c_ulong)))
+
+#The running program's own symbols include libc, no need to look for it
+libc = ctypes.CDLL(None, use_errno=True)
+
+#Settings from the command line, set by configure()
+policy = None
+priority = 0
+audio_cpus = None
+mlock = False
+
+#What actually took effect, and why the rest didn't, for /api/info/status
+applied = {
+    'policy': 'other',
+    'priority': 0,
+    'audio_cpus': None,
+    'web_cpus': None,
+    'mlock': False,
+}
+errors = {}
+
+#Called with every record() as well, the audio process uses it to send
+#what it applied to the main process
+forward = None
+
+class RealtimeError(Exception):
+    pass
+
+#"0,2-3" to [0, 2, 3], as used for --audio-cpus and --web-cpus
+def parse_cpus(text):
+    cpus = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        if not first.isdigit() or not (last or first).isdigit():
+            raise ValueError("invalid CPU list: {}".format(text))
+        if int(first) > int(last or first) or int(last or first) >= CPU_SETSIZE:
+            raise ValueError("invalid CPU list: {}".format(text))
+        cpus.update(xrange(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+def configure(realtime_policy, realtime_priority, cpus, lock):
+    global policy, priority, audio_cpus, mlock
+    policy = realtime_policy
+    priority = realtime_priority
+    audio_cpus = cpus
+    mlock = lock
+
+def call(name, *args):
+    function = getattr(libc, name, None)
+    if function is None:
+        raise RealtimeError("{} is not supported on this system".format(name))
+    if function(*args) != 0:
+        raise RealtimeError(os.strerror(ctypes.get_errno()))
+
+def record(name, value, error=None):
+    applied[name] = value
+    if error is None:
+        errors.pop(name, None)
+    elif errors.get(name) != error:
+        #Only said once, playback threads try again every time they start.
+        #The audio process leaves it to the main one
+        if forward is None:
+            print "RealtimeError: {}: {}".format(name, error)
+        errors[name] = error
+    if forward is not None:
+        forward(name, value, error)
+
+#Scheduling policy and priority of the calling thread
+def get_scheduler():
+    try:
+        param = sched_param()
+        call('sched_getparam', 0, ctypes.byref(param))
+        current = libc.sched_getscheduler(0)
+    except RealtimeError:
+        return 'other', 0
+    names = dict((number, name) for name, number in POLICIES.iteritems())
+    return names.get(current, str(current)), param.sched_priority
+
+#CPUs the calling thread may run on, None if it can't be told
+def get_affinity():
+    mask = CPUSet()
+    try:
+        call('sched_getaffinity', 0, ctypes.sizeof(mask), ctypes.byref(mask))
+    except RealtimeError:
+        return None
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    return [cpu for cpu in xrange(CPU_SETSIZE) if mask[cpu / bits] & (1 << (cpu % bits))]
+
+#Pins the calling thread, and threads it starts from then on, to cpus
+def set_affinity(name, cpus):
+    mask = CPUSet()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    for cpu in cpus:
+        mask[cpu / bits] |= 1 << (cpu % bits)
+    error = None
+    try:
+        call('sched_setaffinity', 0, ctypes.sizeof(mask), ctypes.byref(mask))
+    except RealtimeError as e:
+        error = str(e)
+    record(name, get_affinity(), error)
+
+#Keeps everything mapped now and later in memory, the ring buffers included,
+#so the playback path never waits for a page to be read back in
+def lock_memory():
+    error = None
+    try:
+        call('mlockall', MCL_CURRENT | MCL_FUTURE)
+    except RealtimeError as e:
+        error = str(e)
+    record('mlock', error is None, error)
+
+#Applied by each playback thread as it starts, before it touches the device
+def apply_audio():
+    if audio_cpus is not None:
+        set_affinity('audio_cpus', audio_cpus)
+
+    if policy is not None:
+        error = None
+        try:
+            call('sched_setscheduler', 0, POLICIES[policy], ctypes.byref(sched_param(priority)))
+        except RealtimeError as e:
+            error = str(e)
+        current, current_priority = get_scheduler()
+        record('policy', current, error)
+        record('priority', current_priority)
+
+#Applied from the main thread before the web server, the pump loop and the
+#mixer threads start, which inherit it
+def apply_web(cpus, lock):
+    if cpus is not None:
+        set_affinity('web_cpus', cpus)
+    if lock:
+        lock_memory()
+
+def status():
+    return dict(applied, errors=dict(errors))
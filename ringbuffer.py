@@ -0,0 +1,87 @@
+from threading import Condition
+
+class RingBuffer:
+    # Single producer (libspotify callback), single consumer (playback thread).
+    # head and tail are running byte counts, each only ever advanced by its
+    # owner, so the data itself is never touched under a lock.
+    def __init__(self, periodsize, periods, framesize):
+        self.periodsize = periodsize
+        self.framesize = framesize
+        self.size = periodsize * periods
+
+        self.data = bytearray(self.size)
+        self.view = memoryview(self.data)
+
+        self.head = 0
+        self.tail = 0
+        self.cond = Condition()
+
+    def write(self, data):
+        src = memoryview(data)
+        length = min(len(src), self.size - (self.head - self.tail))
+        # Never store incomplete frames
+        length -= length % self.framesize
+
+        start = self.head % self.size
+        first = min(length, self.size - start)
+        self.view[start:start + first] = src[:first]
+        if length > first:
+            self.view[:length - first] = src[first:length]
+
+        self.head += length
+
+        if self.head - self.tail >= self.periodsize:
+            with self.cond:
+                self.cond.notify()
+
+        return length
+
+    # Blocks until a whole period is buffered or stop is set, returns False
+    # if stopped
+    def wait(self, stop):
+        with self.cond:
+            while self.head - self.tail < self.periodsize and not stop.is_set():
+                self.cond.wait()
+
+        return not stop.is_set()
+
+    # Up to periods whole periods as memoryviews into the buffer, two of them
+    # if the data wraps around its end. None if stopped.
+    def read(self, stop, periods=1):
+        if not self.wait(stop):
+            return None
+
+        length = min(periods, (self.head - self.tail) // self.periodsize) * self.periodsize
+        start = self.offset()
+        first = min(length, self.size - start)
+        views = [self.view[start:start + first]]
+        if length > first:
+            views.append(self.view[:length - first])
+        return views
+
+    # Up to length buffered bytes from the tail that don't wrap, as a whole
+    # number of frames. Used when the consumer takes what the device accepts
+    # rather than whole periods.
+    def peek(self, length):
+        start = self.offset()
+        length = min(length, self.head - self.tail, self.size - start)
+        length -= length % self.framesize
+        return self.view[start:start + length]
+
+    #Offset in data of the bytes returned by read() or peek()
+    def offset(self):
+        return self.tail % self.size
+
+    def consume(self, length):
+        self.tail += length
+
+    def wakeup(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def clear(self):
+        self.head = 0
+        self.tail = 0
+
+    def length(self):
+        return self.head - self.tail
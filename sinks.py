@@ -0,0 +1,275 @@
+import errno
+import fcntl
+import os
+import sys
+import socket
+import struct
+import time
+
+#Largest UDP payload that fits an ethernet frame without fragmenting
+MAX_DATAGRAM = 1400
+#Seconds between attempts to reconnect a dropped TCP stream
+RECONNECT_INTERVAL = 2.0
+CONNECT_TIMEOUT = 0.5
+
+#Duplicate of the original stdout once take_stdout() has run
+stdout_fd = None
+
+class SinkError(Exception):
+    pass
+
+class Pacer:
+    # Holds writes back so they never get more than `ahead` frames in front
+    # of real time. Used where nothing downstream pushes back, the frames
+    # ahead take the place of what a sound card would still have queued.
+    def __init__(self, rate, ahead):
+        self.rate = rate
+        self.ahead = ahead
+        self.underruns = 0
+        self.reset()
+
+    def reset(self):
+        self.start = None
+        self.frames = 0
+
+    def queued(self):
+        if self.start is None:
+            return 0
+        return self.frames - (time.time() - self.start) * self.rate
+
+    def wait(self, frames):
+        queued = self.queued()
+        if queued < 0:
+            #Ran dry, start the clock again from now
+            if self.frames:
+                self.underruns += 1
+            self.reset()
+            queued = 0
+        if self.start is None:
+            self.start = time.time()
+
+        excess = queued + frames - self.ahead
+        if excess > 0:
+            time.sleep(excess / float(self.rate))
+        self.frames += frames
+
+class Sink:
+    # Stands in for an alsaaudio PCM object in Player, with the subset of its
+    # methods Player uses for blocking writes. Subclasses implement
+    # send(data), which writes all of data or raises. Write errors are
+    # reported once and the audio dropped, so a vanished reader can't stop
+    # playback. Paced sinks hold writes back to one device buffer, periods
+    # times periodsize frames, ahead of real time.
+    def __init__(self, rate, channels, periodsize, periods, paced):
+        self.rate = rate
+        self.channels = channels
+        self.periodsize = periodsize
+        self.periods = periods
+        self.framesize = channels * 2 # S16_LE
+        self.pacer = Pacer(rate, periodsize * periods) if paced else None
+        self.failed = False
+
+    def write(self, data):
+        data = memoryview(data)
+        frames = len(data) / self.framesize
+        if self.pacer is not None:
+            self.pacer.wait(frames)
+        try:
+            self.send(data)
+            self.failed = False
+        except (IOError, OSError, socket.error) as error:
+            if not self.failed:
+                print "SinkError: {}".format(error)
+            self.failed = True
+        return frames
+
+    def writev(self, views):
+        return sum(self.write(view) for view in views)
+
+    def delay(self):
+        if self.pacer is None:
+            return 0
+        return max(int(self.pacer.queued()), 0)
+
+    def xruns(self):
+        if self.pacer is None:
+            return 0
+        return self.pacer.underruns
+
+    def pause(self, enable=1):
+        if self.pacer is not None:
+            self.pacer.reset()
+        return 0
+
+    def drop(self):
+        if self.pacer is not None:
+            self.pacer.reset()
+        return 0
+
+    def info(self):
+        return {
+            'channels': self.channels,
+            'rate': self.rate,
+            'periodsize': self.periodsize,
+            'periods': self.periods,
+            'buffersize': self.periodsize * self.periods,
+        }
+
+    def close(self):
+        pass
+
+class FileSink(Sink):
+    # Raw S16_LE PCM appended to a file, or written to a FIFO whose reader
+    # sets the pace
+    def __init__(self, path, rate, channels, periodsize, periods):
+        Sink.__init__(self, rate, channels, periodsize, periods, False)
+        self.path = path
+        try:
+            #Non-blocking so a FIFO without a reader fails instead of hanging
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NONBLOCK, 0644)
+        except OSError as error:
+            if error.errno == errno.ENXIO:
+                raise SinkError("SinkError: No reader on FIFO [{}]".format(path))
+            raise SinkError("SinkError: {}".format(error))
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+    def send(self, data):
+        while len(data):
+            data = data[os.write(self.fd, data):]
+
+    def close(self):
+        os.close(self.fd)
+
+#Moves fd 1 over to stderr and keeps the original for StdoutSink. Called as
+#soon as --output stdout is known, so nothing printed ends up in the audio
+def take_stdout():
+    global stdout_fd
+    if stdout_fd is None:
+        sys.stdout.flush()
+        stdout_fd = os.dup(1)
+        os.dup2(2, 1)
+
+class StdoutSink(FileSink):
+    # Raw PCM on stdout, for piping into another program. Everything printed
+    # goes to stderr instead.
+    def __init__(self, path, rate, channels, periodsize, periods):
+        Sink.__init__(self, rate, channels, periodsize, periods, False)
+        take_stdout()
+        self.fd = stdout_fd
+
+    def close(self):
+        pass
+
+class WavSink(FileSink):
+    # A WAV file, appended to if it exists. The header's sizes are updated
+    # when the sink is closed.
+    def __init__(self, path, rate, channels, periodsize, periods):
+        FileSink.__init__(self, path, rate, channels, periodsize, periods)
+        if os.fstat(self.fd).st_size == 0:
+            self.send(memoryview(self.header(0)))
+
+    def header(self, length):
+        return struct.pack('<4sI4s4sIHHIIHH4sI', 'RIFF', 36 + length, 'WAVE',
+                           'fmt ', 16, 1, self.channels, self.rate,
+                           self.rate * self.framesize, self.framesize, 16,
+                           'data', length)
+
+    def close(self):
+        length = os.fstat(self.fd).st_size - 44
+        os.close(self.fd)
+        #Writes to the O_APPEND descriptor can't go back to the header
+        if length >= 0:
+            fd = os.open(self.path, os.O_WRONLY)
+            os.write(fd, self.header(length))
+            os.close(fd)
+
+class TCPSink(Sink):
+    # Streams raw PCM to host:port, e.g. a snapserver tcp source in server
+    # mode. The send buffer is limited to the device buffer, so a slow
+    # reader pushes back, and if the connection drops audio is thrown away
+    # at the pace it would have played while reconnecting.
+    def __init__(self, address, rate, channels, periodsize, periods):
+        Sink.__init__(self, rate, channels, periodsize, periods, True)
+        self.address = parse_address(address)
+        self.sock = None
+        self.connected_at = 0
+        try:
+            self.connect()
+        except socket.error as error:
+            raise SinkError("SinkError: {} [{}]".format(error, address))
+
+    def connect(self):
+        self.connected_at = time.time()
+        sock = socket.create_connection(self.address, CONNECT_TIMEOUT)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.periodsize * self.periods * self.framesize)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        #Long enough for a reader that's merely slow, not one that's gone
+        sock.settimeout(self.periodsize * self.periods / float(self.rate) + 1)
+        self.sock = sock
+
+    def send(self, data):
+        if self.sock is None:
+            if time.time() - self.connected_at < RECONNECT_INTERVAL:
+                return
+            self.connect()
+        try:
+            self.sock.sendall(data)
+        except socket.error:
+            self.sock.close()
+            self.sock = None
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+class UDPSink(Sink):
+    # Raw PCM to host:port in datagrams of whole frames, paced in real time
+    # as there's no backpressure
+    def __init__(self, address, rate, channels, periodsize, periods):
+        Sink.__init__(self, rate, channels, periodsize, periods, True)
+        self.address = parse_address(address)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.datagram = MAX_DATAGRAM - MAX_DATAGRAM % self.framesize
+
+    def send(self, data):
+        for start in xrange(0, len(data), self.datagram):
+            self.sock.sendto(data[start:start + self.datagram], self.address)
+
+    def close(self):
+        self.sock.close()
+
+class NullSink(Sink):
+    # Throws the audio away, for benchmarks. The target is the playback
+    # speed as a multiple of real time, 0 to take audio as fast as it comes.
+    # Without one (--device left at default) it plays in real time.
+    def __init__(self, target, rate, channels, periodsize, periods):
+        Sink.__init__(self, rate, channels, periodsize, periods, False)
+        try:
+            speed = 1.0 if target in (None, '', 'default') else float(target)
+        except ValueError:
+            raise SinkError("SinkError: Expected a playback speed [{}]".format(target))
+        if speed > 0:
+            self.pacer = Pacer(rate * speed, periodsize * periods)
+
+    def send(self, data):
+        pass
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise SinkError("SinkError: Expected host:port [{}]".format(address))
+    return host, int(port)
+
+SINKS = {
+    'file': FileSink,
+    'wav': WavSink,
+    'stdout': StdoutSink,
+    'tcp': TCPSink,
+    'udp': UDPSink,
+    'null': NullSink,
+}
+
+def open_sink(output, target, rate, channels, periodsize, periods):
+    return SINKS[output](target, rate, channels, periodsize, periods)
@@ -3,6 +3,12 @@ var metadataSetup = false;
 var checkLoginInterval;
 var metadataInterval;
 var slider;
+//Status and metadata are pushed by the server when possible, polled otherwise
+var pushSupported = !!window.EventSource;
+var pushedStatus = {};
+var pushedMetadata = {};
+//Nothing to render until the first metadata event has arrived
+var metadataReceived = false;
 
 //Show a message on the page
 //type is either success, info, warning, or danger
@@ -60,110 +66,132 @@ $('#displayNameForm').submit(function() {
 });
 
 function updateMetadata() {
-    $.ajax('/api/info/metadata').done(function(metadata) {
-        var track = $('#trackInfo');
-        var artist = $('#artistInfo');
-        var album = $('#albumInfo');
-        var albumCover = $('#albumCover');
-        var musicInfo = $('[data-music-info]');
-        var albumCoverPlaceholder = $('#albumCoverPlaceholder');
-
-        //Temporary fix until better error checking is added server side
-        if (metadata.track_uri === '') {
-            musicInfo.text('No music playing');
-            albumCover.hide();
-            albumCoverPlaceholder.show();
-            return;
-        }
+    $.ajax('/api/info/metadata').done(renderMetadata).fail(function(jqXHR, textStatus, error) {
+        console.log("Request failed: " + error);
+    });
+}
 
-        albumCover.show();
-        albumCoverPlaceholder.hide();
+function renderMetadata(metadata) {
+    var track = $('#trackInfo');
+    var artist = $('#artistInfo');
+    var album = $('#albumInfo');
+    var albumCover = $('#albumCover');
+    var musicInfo = $('[data-music-info]');
+    var albumCoverPlaceholder = $('#albumCoverPlaceholder');
+
+    //Temporary fix until better error checking is added server side
+    if (metadata.track_uri === '') {
+        musicInfo.text('No music playing');
+        albumCover.hide();
+        albumCoverPlaceholder.show();
+        return;
+    }
 
-        track.attr('data-id', metadata.track_uri);
-        track.text(metadata.track_name);
+    albumCover.show();
+    albumCoverPlaceholder.hide();
 
-        artist.attr('data-id', metadata.artist_uri);
-        artist.text(metadata.artist_name);
+    track.attr('data-id', metadata.track_uri);
+    track.text(metadata.track_name);
 
-        album.attr('data-id', metadata.album_uri);
-        album.text(metadata.album_name);
+    artist.attr('data-id', metadata.artist_uri);
+    artist.text(metadata.artist_name);
 
-        albumCover.attr('src', '/api/info/image_url/' + metadata.cover_uri)
+    album.attr('data-id', metadata.album_uri);
+    album.text(metadata.album_name);
 
-        volumeSlider.slider('setValue', metadata.volume / 655.35);
-    }).fail(function(jqXHR, textStatus, error) {
+    albumCover.attr('src', '/api/info/image/' + metadata.cover_uri)
+
+    volumeSlider.slider('setValue', metadata.volume / 655.35);
+}
+
+function getStatus() {
+    $.ajax('/api/info/status').done(renderStatus).fail(function(jqXHR, textStatus, error) {
         console.log("Request failed: " + error);
     });
 }
 
-function getStatus() {
-    $.ajax('/api/info/status').done(function(data) {
-        var musicInfo = $('[data-music-info]');
-        var albumCover = $('#albumCover');
-        var albumCoverPlaceholder = $('#albumCoverPlaceholder');
+function renderStatus(data) {
+    var musicInfo = $('[data-music-info]');
+    var albumCover = $('#albumCover');
+    var albumCoverPlaceholder = $('#albumCoverPlaceholder');
 
-        //Display buttons depending on play state
-        $('[data-action=play]').toggle(!data.playing);
-        $('[data-action=pause]').toggle(data.playing);
+    //Display buttons depending on play state
+    $('[data-action=play]').toggle(!data.playing);
+    $('[data-action=pause]').toggle(data.playing);
 
-        $('[data-action=shuffle]').toggleClass('active', data.shuffle);
-        $('[data-action=repeat]').toggleClass('active', data.repeat);
+    $('[data-action=shuffle]').toggleClass('active', data.shuffle);
+    $('[data-action=repeat]').toggleClass('active', data.repeat);
 
-        //$('#player').toggle(data.logged_in);
+    //$('#player').toggle(data.logged_in);
 
-        $('#activeDevice').text(data.active);
-        $('#controls button').toggleClass('disabled', !data.active);
+    $('#activeDevice').text(data.active);
+    $('#controls button').toggleClass('disabled', !data.active);
 
-        $('#loginLink').toggle(!data.logged_in);
-        $('#logoutLink').toggle(data.logged_in);
+    $('#loginLink').toggle(!data.logged_in);
+    $('#logoutLink').toggle(data.logged_in);
 
-        if (data.active) {
-            volumeSlider.slider('enable');
-        } else {
-            volumeSlider.slider('disable');
-        }
+    if (data.active) {
+        volumeSlider.slider('enable');
+    } else {
+        volumeSlider.slider('disable');
+    }
 
 
-        if (!loggedIn && data.logged_in && !metadataSetup) {
-            $('[data-login-required]').show();
-            albumCover.show();
-            albumCoverPlaceholder.hide();
-            loggedIn = true;
-            metadataSetup = true;
+    if (!loggedIn && data.logged_in && !metadataSetup) {
+        $('[data-login-required]').show();
+        albumCover.show();
+        albumCoverPlaceholder.hide();
+        loggedIn = true;
+        metadataSetup = true;
+        if (pushSupported) {
+            if (metadataReceived) {
+                renderMetadata(pushedMetadata);
+            }
+        } else {
             updateMetadata();
             metadataInterval = setInterval(updateMetadata, 5000);
-        } else if (!data.logged_in) {
-            $('[data-login-required]').hide();
-            musicInfo.text('Not logged in');
-            albumCover.hide();
-            albumCoverPlaceholder.show();
-            loggedIn = false;
-            metadataSetup = false;
-            clearInterval(metadataInterval);
-            volumeSlider.slider('disable');
         }
+    } else if (!data.logged_in) {
+        $('[data-login-required]').hide();
+        musicInfo.text('Not logged in');
+        albumCover.hide();
+        albumCoverPlaceholder.show();
+        loggedIn = false;
+        metadataSetup = false;
+        clearInterval(metadataInterval);
+        volumeSlider.slider('disable');
+    }
 
-    }).fail(function(jqXHR, textStatus, error) {
-        console.log("Request failed: " + error);
+    if (pushSupported && (data.logged_in || data.login_failed)) {
+        loginFinished(data.logged_in);
+    }
+}
+
+function loginFinished(success) {
+    var message = $('.container .row .col-md-12 .alert-info:contains("Waiting for spotify")')
+    if (!message.length) {
+        return;
+    }
+    message.removeClass('alert-info');
+    if (success) {
+        message.text('Login Successful');
+        message.addClass('alert-success');
+    } else {
+        message.text('Invalid username or password');
+        message.addClass('alert-danger');
+    }
+    message.fadeOut(5000, function() {
+        message.remove();
     });
 }
 
 function checkLogin() {
     $.ajax('/login/check_login').done(function(data) {
         if (data.finished) {
-            var message = $('.container .row .col-md-12 .alert-info:contains("Waiting for spotify")')
-            message.removeClass('alert-info');
+            loginFinished(data.success);
             if (data.success) {
-                message.text('Login Successful');
-                message.addClass('alert-success');
                 getStatus();
-            } else {
-                message.text('Invalid username or password');
-                message.addClass('alert-danger');
             }
-            message.fadeOut(5000, function() {
-                message.remove();
-            });
             clearInterval(checkLoginInterval);
         }
     }).fail(function(jqXHR, textStatus, error) {
@@ -177,12 +205,28 @@ volumeSlider = $('#volumeSlider').slider({
 	}
 }).on('slideStop', playbackControl);
 
-getStatus();
+if (pushSupported) {
+    //The server sends the full state on connect and only changed fields after that
+    var events = new EventSource('/api/events');
+    events.addEventListener('status', function(e) {
+        $.extend(pushedStatus, JSON.parse(e.data));
+        renderStatus(pushedStatus);
+    });
+    events.addEventListener('metadata', function(e) {
+        $.extend(pushedMetadata, JSON.parse(e.data));
+        metadataReceived = true;
+        if (loggedIn) {
+            renderMetadata(pushedMetadata);
+        }
+    });
+} else {
+    getStatus();
+
+    //Check for login status (and check if selector is empty)
+    if ($('.container .row .col-md-12 .alert-info:contains("Waiting for spotify")').length) {
+        checkLoginInterval = setInterval(checkLogin, 1000);
+    }
 
-//Check for login status (and check if selector is empty)
-if ($('.container .row .col-md-12 .alert-info:contains("Waiting for spotify")').length) {
-    checkLoginInterval = setInterval(checkLogin, 1000);
+    //Update every 5 seconds
+    setInterval(getStatus, 5000);
 }
-
-//Update every 5 seconds
-setInterval(getStatus, 5000);
@@ -1,9 +1,50 @@
+import json
+import hashlib
+from collections import OrderedDict
 from connect_ffi import ffi, lib
+from converters import compile_converter
+
+convert_zeroconf_vars = compile_converter(ffi, 'SpZeroConfVars')
+convert_metadata = compile_converter(ffi, 'SpMetadata')
+
+#Reused by every call, the converters copy everything out of them
+zeroconf_vars_buffer = ffi.new('SpZeroConfVars *')
+metadata_buffer = ffi.new('SpMetadata *')
+image_url_buffer = ffi.new('char[512]')
+range_start = ffi.new('int *')
+range_end = ffi.new('int *')
+
+#A failed call leaves what the last one wrote in the buffer, the empty result
+#is what a fresh buffer converts to
+def clear(buffer):
+    ffi.buffer(buffer)[:] = '\0' * ffi.sizeof(buffer[0])
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            return default
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+tracks = LRUCache(64)
+image_urls = LRUCache(256)
 
 def get_zeroconf_vars():
-    zeroconf_vars = ffi.new('SpZeroConfVars *')
-    lib.SpZeroConfGetVars(zeroconf_vars)
-    return convert_to_python(zeroconf_vars[0])
+    if lib.SpZeroConfGetVars(zeroconf_vars_buffer) != lib.kSpErrorOk:
+        clear(zeroconf_vars_buffer)
+    return convert_zeroconf_vars(zeroconf_vars_buffer[0])
 
 def print_zeroconf_vars():
     zeroconf_vars = get_zeroconf_vars()
@@ -15,36 +56,82 @@ def print_zeroconf_vars():
     print "device type: {}".format(zeroconf_vars['deviceType'])
 
 def get_metadata():
-    metadata = ffi.new('SpMetadata *')
-    lib.SpGetMetadata(metadata, 0)
-    return convert_to_python(metadata[0])
-
-def get_image_url(uri):
-     image_url = ffi.new('char[512]')
-     #TODO: Change back to 640
-     lib.SpGetMetadataImageURL(uri, lib.kSpImageSizeSmall, image_url, ffi.sizeof(image_url))
-     return ffi.string(image_url)
-
-#From https://gist.github.com/inactivist/4ef7058c2132fa16759d
-def __convert_struct_field( s, fields ):
-    for field,fieldtype in fields:
-        if fieldtype.type.kind == 'primitive':
-            yield (field,getattr( s, field ))
-        else:
-            yield (field, convert_to_python( getattr( s, field ) ))
-
-#From https://gist.github.com/inactivist/4ef7058c2132fa16759d
-def convert_to_python(s):
-    type=ffi.typeof(s)
-    if type.kind == 'struct':
-        return dict(__convert_struct_field( s, type.fields ) )
-    elif type.kind == 'array':
-        if type.item.kind == 'primitive':
-            if type.item.cname == 'char':
-                return ffi.string(s)
-            else:
-                return [ s[i] for i in range(type.length) ]
-        else:
-            return [ convert_to_python(s[i]) for i in range(type.length) ]
-    elif type.kind == 'primitive':
-        return int(s)
\ No newline at end of file
+    if lib.SpGetMetadata(metadata_buffer, 0) != lib.kSpErrorOk:
+        clear(metadata_buffer)
+    return convert_metadata(metadata_buffer[0])
+
+IMAGE_SIZES = {
+    'small': lib.kSpImageSizeSmall,
+    'normal': lib.kSpImageSizeNormal,
+    'large': lib.kSpImageSizeLarge
+}
+
+def get_image_url(uri, size=lib.kSpImageSizeSmall):
+     url = image_urls.get((uri, size))
+     if url is None:
+         if lib.SpGetMetadataImageURL(uri, size, image_url_buffer, ffi.sizeof(image_url_buffer)) != lib.kSpErrorOk:
+             return ''
+         url = ffi.string(image_url_buffer)
+         #Not resolved yet, asked again next time
+         if url:
+             image_urls.put((uri, size), url)
+     return url
+
+#Fields of SpMetadata that depend on where a track is played from rather than
+#on the track, read for every entry instead of cached
+CONTEXT_FIELDS = ['context_uri', 'data0']
+
+#Metadata for every track libspotify currently knows about, ordered by offset
+#from the current track (0). Tracks and their cover urls are cached by uri, so
+#after a skip only the newly visible track has to be converted and resolved.
+def get_queue():
+    if lib.SpGetMetadataValidRange(range_start, range_end) != lib.kSpErrorOk:
+        return []
+
+    queue = []
+    for offset in xrange(range_start[0], range_end[0] + 1):
+        if lib.SpGetMetadata(metadata_buffer, offset) != lib.kSpErrorOk:
+            continue
+
+        uri = ffi.string(metadata_buffer.track_uri)
+        track = tracks.get(uri)
+        #Converted again if libspotify has filled in the cover since
+        if track is None or track['cover_uri'] != ffi.string(metadata_buffer.cover_uri):
+            track = convert_metadata(metadata_buffer[0])
+            track['cover_url'] = get_image_url(track['cover_uri']) if track['cover_uri'] else None
+            #Not kept while the cover url is still to be resolved
+            if uri and (track['cover_url'] or not track['cover_uri']):
+                tracks.put(uri, track)
+
+        entry = dict(track, offset=offset)
+        for field in CONTEXT_FIELDS:
+            entry[field] = ffi.string(getattr(metadata_buffer, field))
+        queue.append(entry)
+    return queue
+
+class Snapshot:
+    #Caches the value returned by load, together with its JSON serialization
+    #and an ETag, until it is asked for a different version
+    def __init__(self, load):
+        self.load = load
+        self.version = None
+
+    def get(self, version):
+        if version != self.version:
+            self.store(self.load(), version)
+        return self.value
+
+    #Loads again regardless of the version, for changes that come without a
+    #notification, like a cover url libspotify resolves later
+    def refresh(self):
+        if self.version is None:
+            return
+        value = self.load()
+        if value != self.value:
+            self.store(value, self.version)
+
+    def store(self, value, version):
+        self.value = value
+        self.body = json.dumps(value)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.version = version